@@ -0,0 +1,48 @@
+"""AI log append cost: async appender against one INSERT + commit per row.
+
+    python bench/bench_ai_logs.py [rows]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-ai-logs-'))
+
+import app  # noqa: E402
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    conn = sqlite3.connect('trading.db')
+    conn.execute('''
+        CREATE TABLE sync_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME, action TEXT, symbol TEXT,
+                                signal_type TEXT, confidence REAL, price REAL, quantity INTEGER, reason TEXT, status TEXT)
+    ''')
+    sample = min(rows, 2000)
+    started = time.perf_counter()
+    for i in range(sample):
+        conn.execute('INSERT INTO sync_logs (timestamp, action, symbol, status) VALUES (CURRENT_TIMESTAMP, ?, ?, ?)',
+                     ('SIGNAL', 'INFY', 'SUCCESS'))
+        conn.commit()
+    sync_us = (time.perf_counter() - started) / sample * 1e6
+    conn.close()
+
+    logs = app.AILogAppender()
+    started = time.perf_counter()
+    for i in range(rows):
+        logs.append('SIGNAL', symbol='INFY', signal_type='BUY', confidence=80.0, price=100.0, status='SUCCESS')
+    append_us = (time.perf_counter() - started) / rows * 1e6
+    logs.flush()
+    drained = time.perf_counter() - started
+
+    print(f"sync insert+commit: {sync_us:.1f} us/row ({sample} rows)")
+    print(f"async append: {append_us:.2f} us/row on the caller; {rows} rows written in {drained:.2f} s")
+    print(logs.snapshot())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""CandleBuilder tick throughput on one core.
+
+Feeds full-mode ticks for a full-market universe through on_ticks in the
+batch sizes KiteTicker delivers, in memory only and with completed bars
+flushed to SQLite by the background flusher, and prints ticks/sec.
+
+    python bench/bench_candles.py [ticks] [instruments]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-candles-'))
+
+import app  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    instruments = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    app.init_db()
+    random.seed(1)
+    start = datetime.now().replace(hour=9, minute=15, second=0, microsecond=0)
+    # Ten ticks per instrument per second, so every interval rolls over during the run
+    ticks = [{'instrument_token': 1 + i % instruments, 'last_price': 100 + random.random(), 'volume_traded': i,
+              'exchange_timestamp': start + timedelta(seconds=i // (10 * instruments))} for i in range(count)]
+    batch = 200
+
+    for persist in (False, True):
+        builder = app.CandleBuilder(persist=persist)
+        started = time.perf_counter()
+        for i in range(0, count, batch):
+            builder.on_ticks(ticks[i:i + batch])
+        elapsed = time.perf_counter() - started
+        if persist:
+            builder.flush()
+        snapshot = builder.snapshot()
+        print(f"on_ticks (persist={persist}): {count / elapsed:,.0f} ticks/sec over "
+              f"{snapshot['instruments']} instruments, {snapshot['flushed']} bars flushed")
+        print(snapshot['update_latency_per_tick'])
+    os._exit(0)  # The flusher thread is a daemon that never returns
+
+
+if __name__ == '__main__':
+    main()
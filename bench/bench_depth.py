@@ -0,0 +1,55 @@
+"""Depth ingest cost per full-mode tick against storing the raw tick dict.
+
+The baseline is what kite_on_ticks already pays per tick (one dict store);
+DepthBook ingest copies five levels into its preallocated row and computes
+the features in the same pass.
+
+    python bench/bench_depth.py [instruments] [ticks]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-depth-'))
+
+import app  # noqa: E402
+
+
+def tick(token):
+    bid = 100 + random.random()
+    return {'instrument_token': token, 'last_price': bid, 'depth': {
+        'buy': [{'price': bid - 0.05 * k, 'quantity': random.randint(1, 500), 'orders': 3} for k in range(5)],
+        'sell': [{'price': bid + 0.05 + 0.05 * k, 'quantity': random.randint(1, 500), 'orders': 3} for k in range(5)]}}
+
+
+def main():
+    instruments = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    random.seed(1)
+    ticks = [tick(i % instruments) for i in range(count)]
+    book = app.DepthBook()
+    book.track(range(instruments))
+
+    latest = {}
+    started = time.perf_counter_ns()
+    for t in ticks:
+        token = t.get('instrument_token')
+        if token is not None:
+            latest[token] = t
+    baseline_ns = (time.perf_counter_ns() - started) / count
+
+    started = time.perf_counter_ns()
+    for i in range(0, count, 100):
+        book.on_ticks(ticks[i:i + 100])
+    ingest_ns = (time.perf_counter_ns() - started) / count
+
+    print(f"dict store: {baseline_ns:.0f} ns/tick")
+    print(f"depth ingest: {ingest_ns:.0f} ns/tick ({instruments} instruments, capacity {book.capacity})")
+    print(book.snapshot())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""InstrumentIndex search latency on a full-market instrument master.
+
+Builds a synthetic master shaped like Kite's NSE + NFO + BSE dump: cash
+equities whose names share common words (INDUSTRIES, BANK, FINANCE, ...),
+monthly futures and an option chain per F&O underlying. Then times exact,
+prefix, filtered and typo (fuzzy) queries and prints p50/p99 per kind.
+
+    python bench/bench_instrument_search.py [rows]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-search-'))
+
+import app  # noqa: E402
+
+WORDS = ['TATA', 'RELIANCE', 'HDFC', 'ICICI', 'BAJAJ', 'ADANI', 'MAHINDRA', 'JINDAL', 'BHARAT', 'HINDUSTAN',
+         'INDIAN', 'NATIONAL', 'UNITED', 'GUJARAT', 'KOTAK', 'SHREE', 'GODREJ', 'ASIAN', 'SUN', 'POWER']
+SUFFIXES = ['INDUSTRIES', 'BANK', 'FINANCE', 'MOTORS', 'STEEL', 'CEMENT', 'PHARMA', 'CHEMICALS', 'TEXTILES',
+            'POWER', 'INFRA', 'ENERGY', 'LIMITED', 'CAPITAL', 'HOLDINGS', 'AUTO', 'FOODS', 'PAPER', 'SUGAR', 'TECH']
+
+
+def universe(rows):
+    random.seed(7)
+    master, equities = [], []
+    token = 1
+    while len(equities) < 6000:
+        # Made-up syllables keep the distinct names realistic in number
+        stem = ''.join(random.choice('ABCDEFGHIKLMNOPRSTUVY') for _ in range(random.randint(3, 8)))
+        name = f"{random.choice(WORDS + [stem])} {stem} {random.choice(SUFFIXES)}"
+        symbol = (stem + random.choice(['', 'IND', 'BNK', 'LTD']))[:10]
+        equities.append((symbol, name))
+    for exchange in ('NSE', 'BSE'):
+        for symbol, name in equities[:3000 if exchange == 'NSE' else 6000]:
+            master.append({'instrument_token': token, 'tradingsymbol': symbol, 'name': name, 'exchange': exchange,
+                           'segment': exchange, 'instrument_type': 'EQ', 'lot_size': 1})
+            token += 1
+    underlyings = equities[:200]
+    expiries = ['24MAR', '24APR', '24MAY']
+    while len(master) < rows:
+        for symbol, name in underlyings:
+            for expiry in expiries:
+                master.append({'instrument_token': token, 'tradingsymbol': f"{symbol}{expiry}FUT", 'name': name,
+                               'exchange': 'NFO', 'segment': 'NFO-FUT', 'instrument_type': 'FUT',
+                               'expiry': expiry, 'lot_size': 250})
+                token += 1
+                for strike in range(900, 1100, 5):
+                    for kind in ('CE', 'PE'):
+                        master.append({'instrument_token': token, 'tradingsymbol': f"{symbol}{expiry}{strike}{kind}",
+                                       'name': name, 'exchange': 'NFO', 'segment': 'NFO-OPT',
+                                       'instrument_type': kind, 'expiry': expiry, 'strike': strike,
+                                       'lot_size': 250})
+                        token += 1
+                if len(master) >= rows:
+                    return master[:rows], equities
+    return master, equities
+
+
+def typo(text):
+    i = random.randrange(1, len(text) - 1)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    master, equities = universe(rows)
+    started = time.perf_counter()
+    index = app.InstrumentIndex(master)
+    print(f"built {len(index)} rows, {len(index.keys)} fuzzy keys in {time.perf_counter() - started:.2f}s; "
+          f"largest posting list {max(len(p) for p in index.postings.values())} keys")
+
+    random.seed(11)
+    sample = random.sample(equities[:3000], 500)
+    # (query, filters, symbol the results should contain)
+    kinds = {
+        'exact': [(symbol, {}, symbol) for symbol, _ in sample],
+        'prefix': [(symbol[:3], {}, None) for symbol, _ in sample],
+        'name prefix': [(name.split()[0], {}, None) for _, name in sample],
+        'segment filter': [(symbol[:4], {'segment': 'NFO-OPT', 'instrument_type': 'CE'}, None)
+                           for symbol, _ in sample],
+        'typo symbol': [(typo(symbol), {}, symbol) for symbol, _ in sample],
+        'typo name': [(typo(name), {}, symbol) for symbol, name in sample],
+        'typo + filter': [(typo(name), {'segment': 'NSE'}, symbol) for symbol, name in sample],
+        'common word': [(word, {}, None) for word in SUFFIXES * 25],
+    }
+    for kind, queries in kinds.items():
+        times = []
+        found = expected = 0
+        for q, filters, symbol in queries:
+            began = time.perf_counter_ns()
+            results = index.search(q, limit=10, **filters)
+            times.append(time.perf_counter_ns() - began)
+            if symbol:
+                expected += 1
+                found += any(r['tradingsymbol'] == symbol for r in results)
+        times.sort()
+        recall = f"  found {found / expected:.0%}" if expected else ''
+        print(f"{kind:>15}: p50 {times[len(times) // 2] / 1000:7.1f} us  "
+              f"p99 {times[int(len(times) * 0.99)] / 1000:7.1f} us  max {times[-1] / 1000:7.1f} us{recall}")
+
+
+if __name__ == '__main__':
+    main()
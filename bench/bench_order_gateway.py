@@ -0,0 +1,85 @@
+"""Order gateway throughput against a fake broker.
+
+Submits a burst of entries with a few exits and cancels mixed in, against a
+broker that takes BROKER_LATENCY_MS per call, and reports the dispatch rate
+(bounded by the token bucket), submit cost and submit-to-ack latency per
+priority.
+
+    python bench/bench_order_gateway.py [orders] [rate]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-gateway-'))
+
+import app  # noqa: E402
+
+BROKER_LATENCY_MS = 40
+
+
+class SlowBroker:
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _call(self):
+        time.sleep(BROKER_LATENCY_MS / 1000)
+        with self.lock:
+            self.calls += 1
+            return f"O{self.calls}"
+
+    def place_order(self, variety, **params):
+        return self._call()
+
+    def cancel_order(self, variety, **params):
+        return self._call()
+
+    def orders(self):
+        return []
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    gateway = app.OrderGateway(client=SlowBroker(), rate=rate, workers=8)
+    latencies = {'ENTRY': [], 'EXIT': [], 'CANCEL': []}
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def on_ack(kind, submitted):
+        def record(ack):
+            with lock:
+                latencies[kind].append(time.perf_counter() - submitted)
+                if sum(map(len, latencies.values())) == orders:
+                    done.set()
+        return record
+
+    params = {'exchange': 'NSE', 'tradingsymbol': 'INFY', 'transaction_type': 'BUY', 'quantity': 1,
+              'product': 'MIS', 'order_type': 'MARKET'}
+    started = time.perf_counter()
+    for i in range(orders):
+        kind = 'CANCEL' if i % 10 == 9 else 'EXIT' if i % 10 == 5 else 'ENTRY'
+        body = {'order_id': f"X{i}"} if kind == 'CANCEL' else params
+        gateway.submit(kind, body, on_ack=on_ack(kind, time.perf_counter()))
+    submit_us = (time.perf_counter() - started) / orders * 1e6
+    done.wait(orders / rate * 2 + 10)
+    elapsed = time.perf_counter() - started
+    gateway.stop()
+
+    print(f"{orders} orders, rate limit {rate}/s (burst {gateway.bucket.capacity:.0f}), "
+          f"broker latency {BROKER_LATENCY_MS} ms")
+    print(f"submit: {submit_us:.1f} us/order; dispatched {orders / elapsed:.1f} orders/s")
+    for kind, values in latencies.items():
+        if values:
+            values.sort()
+            print(f"{kind:>6}: n={len(values)} p50={values[len(values) // 2] * 1000:.0f} ms "
+                  f"p99={values[int(len(values) * 0.99)] * 1000:.0f} ms")
+    print(gateway.snapshot())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Paper exchange submit and tick-matching cost with 100k resting orders.
+
+Rests orders across 500 instruments, then measures per-tick matching when
+nothing crosses (the common case; only the top of each book is looked at)
+and when every book's best level crosses.
+
+    python bench/bench_paper_exchange.py [orders] [instruments]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-paper-'))
+
+import app  # noqa: E402
+
+
+def depth(bid, ask, quantity=100):
+    return {'buy': [{'price': bid - i * 0.05, 'quantity': quantity, 'orders': 1} for i in range(5)],
+            'sell': [{'price': ask + i * 0.05, 'quantity': quantity, 'orders': 1} for i in range(5)]}
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    instruments = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    random.seed(1)
+    app.init_db()
+    app.RISK_ENGINE.load()
+    app.RISK_ENGINE.risk_level = 'high'
+    account = app.RISK_ENGINE._account('paper')
+    account.capital, account.balance = 0, 1e15
+    exchange = app.PaperExchange()
+    for i in range(instruments):
+        app.symbol_by_token[1000 + i] = f"X{i}"
+
+    started = time.perf_counter()
+    for _ in range(orders):
+        side = random.choice(('BUY', 'SELL'))
+        offset = random.uniform(0.5, 5)
+        exchange.submit(f"X{random.randrange(instruments)}", side, 10, 'LIMIT',
+                        round(100 - offset if side == 'BUY' else 100 + offset, 2))
+    submit_us = (time.perf_counter() - started) / orders * 1e6
+    print(f"submit: {submit_us:.1f} us/order, {exchange.snapshot()['resting_orders']} resting")
+
+    rounds = 20
+    ticks = [{'instrument_token': 1000 + i, 'last_price': 100.0, 'depth': depth(99.95, 100.05)}
+             for i in range(instruments)]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        exchange.on_ticks(ticks)
+    quiet_us = (time.perf_counter() - started) / (rounds * instruments) * 1e6
+    print(f"non-crossing tick: {quiet_us:.2f} us/tick")
+
+    rounds = 5
+    ticks = [{'instrument_token': 1000 + i, 'last_price': 99.0, 'depth': depth(98.9, 99.0, quantity=50)}
+             for i in range(instruments)]
+    fills = exchange.counters['fills']
+    started = time.perf_counter()
+    for _ in range(rounds):
+        exchange.on_ticks(ticks)
+    crossing_us = (time.perf_counter() - started) / (rounds * instruments) * 1e6
+    print(f"crossing tick: {crossing_us:.2f} us/tick, {exchange.counters['fills'] - fills} fills")
+    print(exchange.snapshot()['match_latency'])
+    os._exit(0)  # Skip waiting for the fill writer
+
+
+if __name__ == '__main__':
+    main()
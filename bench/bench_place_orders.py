@@ -0,0 +1,67 @@
+"""Order placement throughput through the Flask endpoints.
+
+Measures orders/sec for /api/place-order one request per order and for
+/api/place-orders at several batch sizes, each order carrying a
+client_order_id, plus the raw OrderIdGenerator rate.
+
+    python bench/bench_place_orders.py [orders]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-orders-'))
+
+import app  # noqa: E402
+
+
+def order(key):
+    return {'symbol': f"S{key % 200}", 'side': 'BUY', 'quantity': 1, 'price': 100.0, 'client_order_id': f"k{key}"}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    app.init_db()
+    app.RISK_ENGINE.load()
+    app.RISK_ENGINE.risk_level = 'high'
+    account = app.RISK_ENGINE._account('paper')
+    account.capital, account.balance = 0, 1e15
+    client = app.app.test_client()
+
+    generator = app.OrderIdGenerator(worker_id=1)
+    started = time.perf_counter()
+    for _ in range(200000):
+        generator.next_id()
+    print(f"OrderIdGenerator: {200000 / (time.perf_counter() - started):,.0f} ids/sec")
+
+    key = 0
+    single = min(count, 2000)
+    started = time.perf_counter()
+    for _ in range(single):
+        assert client.post('/api/place-order', json=order(key)).status_code == 200
+        key += 1
+    print(f"/api/place-order: {single / (time.perf_counter() - started):,.0f} orders/sec")
+
+    for batch in (10, 100, app.MAX_BULK_ORDERS):
+        placed = 0
+        started = time.perf_counter()
+        while placed < count:
+            orders = [order(key + i) for i in range(batch)]
+            key += batch
+            assert client.post('/api/place-orders', json={'orders': orders}).status_code == 200
+            placed += batch
+        print(f"/api/place-orders x{batch}: {placed / (time.perf_counter() - started):,.0f} orders/sec")
+
+    # Replays resolve from the idempotency index instead of inserting
+    orders = [order(i) for i in range(app.MAX_BULK_ORDERS)]
+    started = time.perf_counter()
+    for _ in range(10):
+        assert client.post('/api/place-orders', json={'orders': orders}).get_json()['placed'] == 0
+    print(f"/api/place-orders replay x{len(orders)}: "
+          f"{10 * len(orders) / (time.perf_counter() - started):,.0f} orders/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Pre-trade check cost as the number of open positions grows.
+
+reserve() should stay flat: it touches only the order's own symbol and the
+account totals, however many positions are open.
+
+    python bench/bench_risk_engine.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-risk-'))
+
+import app  # noqa: E402
+
+
+def main():
+    for positions in (10, 1000, 100000):
+        engine = app.RiskEngine()
+        engine.load()
+        engine.risk_level = 'high'
+        account = engine._account('paper')
+        account.capital = account.balance = 1e15
+        for i in range(positions):
+            engine.reserve('paper', f"S{i}", 'BUY', 1, 100.0)
+        n = 100000
+        started = time.perf_counter()
+        for i in range(n):
+            engine.reserve('paper', f"S{i % positions}", 'BUY' if i % 2 else 'SELL', 1, 100.0)
+        elapsed = time.perf_counter() - started
+        print(f"{positions:>7} open positions: {elapsed / n * 1e6:.2f} us/reserve")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Paper account stress test wall time on the process pool.
+
+Opens two paper positions, then times run_stress_test at increasing path
+counts and on a 20-day, 375-step horizon where chunks are sized by memory.
+STRESS_TEST_WORKERS sets the pool size, as in the app.
+
+    python bench/bench_stress.py [paths ...]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-stress-'))
+
+import app  # noqa: E402
+
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    conn = sqlite3.connect('trading.db')
+    conn.executemany('''
+        INSERT INTO trades (trade_id, symbol, side, quantity, entry_price, stop_loss, take_profit, account_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'paper')
+    ''', [('B1', 'TCS', 'BUY', 10, 3800, 3700, 3900), ('B2', 'INFY', 'SELL', 20, 1790, None, None)])
+    conn.commit()
+    conn.close()
+
+    app.run_stress_test(paths=100, seed=1)  # Start the pool and load history outside the timings
+    for paths in counts:
+        started = time.perf_counter()
+        result = app.run_stress_test(paths=paths, seed=7)
+        print(f"{paths:>7} paths: {time.perf_counter() - started:.2f} s, {result['chunks']} chunks of "
+              f"{result['chunk_paths']}, VaR95 {result['var']['95']}")
+
+    started = time.perf_counter()
+    result = app.run_stress_test(paths=2000, days=20, steps_per_day=375, seed=7)
+    print(f"20 days x 375 steps, 2000 paths: {time.perf_counter() - started:.2f} s, "
+          f"{result['chunks']} chunks of {result['chunk_paths']}")
+    app.STRESS_POOL.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Tick journal recording overhead and replay throughput.
+
+Records full-mode ticks in batches the size KiteTicker delivers, then
+replays the day at max speed into a no-op callback (decode cost alone) and
+into the default isolated ReplaySink (decode plus quotes and candles).
+
+    python bench/bench_tick_journal.py [ticks] [instruments]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-journal-'))
+
+import app  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    instruments = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    random.seed(1)
+    start = datetime.now().replace(hour=9, minute=15, second=0, microsecond=0)
+    ticks = []
+    for i in range(count):
+        price = 100 + random.random()
+        ticks.append({'instrument_token': 1 + i % instruments, 'last_price': price, 'volume_traded': i,
+                      'exchange_timestamp': start + timedelta(milliseconds=i // 10),
+                      'depth': {'buy': [{'price': price - 0.05, 'quantity': 10, 'orders': 1}] * 5,
+                                'sell': [{'price': price + 0.05, 'quantity': 10, 'orders': 1}] * 5}})
+
+    journal = app.TickJournal('ticks')
+    batch = 100
+    started = time.perf_counter_ns()
+    for i in range(0, count, batch):
+        journal.record(ticks[i:i + batch])
+    record_ns = (time.perf_counter_ns() - started) / count
+    journal.close()
+    print(f"record: {record_ns:.0f} ns/tick, {journal.segments} segments")
+    print(journal.snapshot()['record_latency_per_tick'])
+
+    stats = app.TickReplayer('ticks', journal.day, speed=0, on_ticks=lambda ws, ticks: None).run()
+    print(f"replay (no-op consumer): {stats['ticks_per_sec']:,.0f} ticks/sec")
+    replayer = app.TickReplayer('ticks', journal.day, speed=0)
+    stats = replayer.run()
+    print(f"replay (isolated sink): {stats['ticks_per_sec']:,.0f} ticks/sec, "
+          f"{replayer.sink.snapshot()['instruments']} instruments")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Trigger engine price-update cost against the number of live triggers.
+
+Non-crossing updates only peek at the top of each heap, so their cost should
+not depend on how many triggers an instrument has.
+
+    python bench/bench_triggers.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-triggers-'))
+
+import app  # noqa: E402
+
+
+def main():
+    random.seed(1)
+    for count in (100, 10000, 100000):
+        fired = []
+        engine = app.TriggerEngine(lambda trigger, kind, price: fired.append(trigger.trade_id))
+        for i in range(count):
+            entry = 100.0 + random.uniform(-1, 1)
+            engine.register(f"T{i}", 'INFY', random.choice(('BUY', 'SELL')), entry,
+                            entry * random.uniform(0.90, 0.97), entry * random.uniform(1.03, 1.10))
+        updates = 200000
+        started = time.perf_counter()
+        for _ in range(updates):
+            engine.on_price('INFY', 100.0 + random.uniform(-2, 2))
+        quiet = (time.perf_counter() - started) / updates * 1e6
+
+        started = time.perf_counter()
+        engine.on_price('INFY', 200.0)
+        engine.on_price('INFY', 1.0)
+        sweep = time.perf_counter() - started
+        print(f"{count:>6} triggers: {quiet:.2f} us per quiet update; "
+              f"firing all {len(fired)} took {sweep * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Quote endpoint latency while the broker hangs.
+
+Fires concurrent /api/zerodha/quote requests at a fake Kite client that first
+answers in 5 ms and then hangs for 10 s. With the kite upstream guard, the
+hung phase should answer within the timeout, serving cached quotes as stale
+and failing uncached symbols fast once the breaker opens.
+
+    python bench/bench_upstream.py [concurrency]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='bench-upstream-'))
+
+import app  # noqa: E402
+
+HUNG = {'on': False}
+
+
+class FakeKite:
+    def quote(self, scrips):
+        time.sleep(10 if HUNG['on'] else 0.005)
+        return {s: {'last_price': 100.0} for s in scrips}
+
+
+def run(client, concurrency, path):
+    latencies, codes, lock = [], {}, threading.Lock()
+
+    def one():
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            codes[status] = codes.get(status, 0) + 1
+
+    threads = [threading.Thread(target=one) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return (f"codes={codes} p50={latencies[len(latencies) // 2] * 1000:.0f} ms "
+            f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms max={latencies[-1] * 1000:.0f} ms")
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    app.kite, app.ZERODHA_CONNECTED = FakeKite(), True
+    app.UPSTREAMS['kite'] = app.Upstream('kite', timeout=0.5, max_concurrent=4, failure_threshold=3,
+                                         reset_timeout=1.0, is_outage=app._is_kite_outage)
+    client = app.app.test_client()
+    print('healthy          ', run(client, concurrency, '/api/zerodha/quote/TCS'))
+    HUNG['on'] = True
+    print('hung, cached     ', run(client, concurrency, '/api/zerodha/quote/TCS'))
+    print('hung, uncached   ', run(client, concurrency, '/api/zerodha/quote/INFY'))
+    print(app.UPSTREAMS['kite'].snapshot())
+    os._exit(0)  # Hung calls still hold their worker threads
+
+
+if __name__ == '__main__':
+    main()
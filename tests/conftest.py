@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app creates trading.db in the working directory on import; keep it out of the checkout
+os.chdir(tempfile.mkdtemp(prefix='alfa-tests-'))
+
+import app as trading_app  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return trading_app
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh trading.db in its own directory, with a freshly loaded risk engine"""
+    monkeypatch.chdir(tmp_path)
+    trading_app.init_db()
+    monkeypatch.setattr(trading_app, 'RISK_ENGINE', trading_app.RiskEngine())
+    trading_app.RISK_ENGINE.load()
+    return tmp_path / 'trading.db'
+
+
+@pytest.fixture
+def client(db):
+    return trading_app.app.test_client()
+
+
+def wait_for(predicate, timeout=5.0, interval=0.01):
+    """Poll until predicate() is truthy; background threads do the work under test"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
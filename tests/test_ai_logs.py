@@ -0,0 +1,98 @@
+import gzip
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+
+def _row(app, day, action='SIGNAL', symbol='INFY'):
+    return (day.strftime('%Y-%m-%d 10:00:00'), action, symbol, 'BUY', 80.0, 100.0, 1, 'test', 'SUCCESS')
+
+
+def test_appends_are_written_to_the_day_table(app, db):
+    logs = app.AILogAppender(flush_interval=0.01)
+    for i in range(1200):
+        assert logs.append('SIGNAL', symbol='INFY' if i % 2 else 'TCS', status='SUCCESS')
+    logs.flush()
+    table = logs.table_for(datetime.utcnow().strftime('%Y%m%d'))
+    conn = sqlite3.connect(db)
+    assert conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] == 1200
+    assert logs.snapshot()['written'] == 1200
+
+
+def test_query_pages_newest_first_across_days(app, db):
+    logs = app.AILogAppender()
+    today = datetime.utcnow()
+    logs._write([_row(app, today - timedelta(days=1)) for _ in range(3)] + [_row(app, today) for _ in range(3)])
+    logs._write([_row(app, today, symbol='TCS')])
+    rows, cursor = logs.query(symbol='INFY', limit=4)
+    assert [r['day'] for r in rows] == [today.strftime('%Y%m%d')] * 3 + [(today - timedelta(days=1)).strftime('%Y%m%d')]
+    assert cursor is not None
+    rest, cursor = logs.query(symbol='INFY', limit=4, cursor_token=cursor)
+    assert len(rest) == 2 and cursor is None
+    seen = {(r['day'], r['id']) for r in rows}
+    assert seen.isdisjoint((r['day'], r['id']) for r in rest)
+
+
+def test_retention_archives_and_drops_old_days(app, db, tmp_path):
+    logs = app.AILogAppender(retention_days=7, archive_dir=str(tmp_path / 'archive'))
+    old, recent = datetime.utcnow() - timedelta(days=10), datetime.utcnow()
+    logs._write([_row(app, old), _row(app, old), _row(app, recent)])
+    logs.enforce_retention()
+    conn = sqlite3.connect(db)
+    assert logs.days(conn.cursor()) == [recent.strftime('%Y%m%d')]
+    archive = tmp_path / 'archive' / f"{logs.table_for(old.strftime('%Y%m%d'))}.jsonl.gz"
+    with gzip.open(archive, 'rt') as f:
+        archived = [json.loads(line) for line in f]
+    assert len(archived) == 2 and archived[0]['symbol'] == 'INFY'
+
+
+def test_full_queue_drops_instead_of_blocking(app, db, monkeypatch):
+    logs = app.AILogAppender(max_pending=2)
+    monkeypatch.setattr(logs, '_start', lambda: None)  # No writer: the queue only fills
+    assert logs.append('A') and logs.append('B')
+    assert not logs.append('C')
+    assert logs.snapshot()['dropped'] == 1
+
+
+def test_logs_endpoint(app, client, monkeypatch):
+    logs = app.AILogAppender(flush_interval=0.01)
+    monkeypatch.setattr(app, 'AI_LOGS', logs)
+    app.log_ai_action('TRADE_EXECUTED', symbol='INFY', status='SUCCESS')
+    logs.flush()
+    response = client.get('/api/ai-trading/logs?symbol=INFY')
+    assert response.status_code == 200
+    assert [row['action'] for row in response.get_json()['logs']] == ['TRADE_EXECUTED']
+
+
+def test_legacy_log_table_is_migrated_once(app, db, tmp_path, monkeypatch):
+    logs = app.AILogAppender(retention_days=30, archive_dir=str(tmp_path / 'archive'))
+    monkeypatch.setattr(app, 'AI_LOGS', logs)
+    recent, old = datetime.utcnow() - timedelta(days=1), datetime.utcnow() - timedelta(days=40)
+    conn = sqlite3.connect(db)
+    conn.execute('''
+        CREATE TABLE ai_trading_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            action TEXT NOT NULL, symbol TEXT, signal_type TEXT, confidence REAL, price REAL, quantity INTEGER,
+            reason TEXT, status TEXT)
+    ''')
+    conn.executemany('INSERT INTO ai_trading_logs (timestamp, action, symbol) VALUES (?, ?, ?)', [
+        (recent.strftime('%Y-%m-%d 09:00:00'), 'SIGNAL', 'INFY'),
+        (old.strftime('%Y-%m-%d 09:00:00'), 'SIGNAL', 'TCS'),
+        (recent.strftime('%Y-%m-%dT10:00:00'), 'TRADE_EXECUTED', 'INFY'),
+        ('garbage', 'ERROR', None),
+    ])
+    conn.commit()
+
+    app.init_db()
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'ai_trading_logs' not in tables
+    assert logs.days(conn.cursor()) == sorted({recent.strftime('%Y%m%d'), datetime.utcnow().strftime('%Y%m%d')})
+    rows, _ = logs.query(day_from=recent.strftime('%Y%m%d'), day_to=recent.strftime('%Y%m%d'))
+    assert [(r['action'], r['timestamp']) for r in rows] == [
+        ('TRADE_EXECUTED', recent.strftime('%Y-%m-%d 10:00:00')), ('SIGNAL', recent.strftime('%Y-%m-%d 09:00:00'))]
+    assert [r['action'] for r in logs.query(action='ERROR')[0]] == ['ERROR']
+    # Rows past retention go straight to the archive
+    with gzip.open(tmp_path / 'archive' / f"{logs.table_for(old.strftime('%Y%m%d'))}.jsonl.gz", 'rt') as f:
+        assert [json.loads(line)['symbol'] for line in f] == ['TCS']
+
+    app.init_db()
+    assert len(logs.query()[0]) == 3
@@ -0,0 +1,113 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+CAPITAL = 10000.0
+
+# (trade_id, symbol, strategy, pnl, entry, exit, status); 2024-03-04 is a Monday, "today" is Friday 03-08
+TRADES = [
+    ('a', 'RELIANCE', 'momentum', 200.0, '2024-03-04 09:30:00', '2024-03-04 10:00:00', None),
+    ('b', 'TCS', 'mean_reversion', -50.0, '2024-03-04 11:00:00', '2024-03-04 11:10:00', 'CLOSED'),
+    ('c', 'RELIANCE', 'momentum', -300.0, '2024-03-06 09:15:00', '2024-03-06 10:15:00', None),
+    ('failed', 'INFY', 'momentum', 999.0, '2024-03-07 09:15:00', '2024-03-07 09:15:00', 'FAILED'),
+    ('open', 'INFY', 'momentum', None, '2024-03-07 10:00:00', None, 'OPEN'),
+    ('d', 'TCS', 'momentum', 100.0, '2024-03-08 09:40:00', '2024-03-08 10:00:00', None),
+]
+
+
+class _Friday(datetime):
+    @classmethod
+    def utcnow(cls):
+        return cls(2024, 3, 8, 12, 0)
+
+
+def _insert(db, trades, account_type='paper'):
+    conn = sqlite3.connect(db)
+    conn.executemany('''
+        INSERT INTO trades (trade_id, symbol, side, quantity, entry_price, exit_price, pnl, strategy,
+                            account_type, timestamp, exit_timestamp, status)
+        VALUES (?, ?, 'BUY', 1, 100, CASE WHEN ? IS NULL THEN NULL ELSE 100 END, ?, ?, ?, ?, ?, ?)
+    ''', [(t, symbol, exit_ts, pnl, strategy, account_type, entry_ts, exit_ts, status)
+          for t, symbol, strategy, pnl, entry_ts, exit_ts, status in trades])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def analytics(app, db, monkeypatch):
+    monkeypatch.setattr(app, 'datetime', _Friday)
+    _insert(db, TRADES)
+    _insert(db, [('live', 'TCS', 'momentum', 5000.0, '2024-03-05 09:15:00', '2024-03-05 10:15:00', None)],
+            account_type='live')
+    return app.PortfolioAnalytics()
+
+
+def test_metrics_match_a_hand_computed_fixture(analytics):
+    result = analytics.compute('paper', CAPITAL)
+    # Daily P&L over every weekday, flat Tuesday/Thursday included: 150, 0, -300, 0, 100
+    assert [(p['date'], p['pnl'], p['equity'], p['drawdown_pct']) for p in result['equity_curve']] == [
+        ('2024-03-04', 150.0, 10150.0, 0.0),
+        ('2024-03-05', 0.0, 10150.0, 0.0),
+        ('2024-03-06', -300.0, 9850.0, -2.96),
+        ('2024-03-07', 0.0, 9850.0, -2.96),
+        ('2024-03-08', 100.0, 9950.0, -1.97),
+    ]
+    assert (result['days'], result['active_days'], result['trades'], result['total_pnl']) == (5, 3, 4, -50.0)
+    assert result['max_drawdown_pct'] == -2.96
+    # Returns 150/10000, 0, -300/10150, 0, 100/9850: mean / sample stdev * sqrt(252), and
+    # mean / downside deviation (300/10150, the single losing day) * sqrt(252)
+    assert result['sharpe_ratio'] == -0.808
+    assert result['sortino_ratio'] == -0.473
+    assert result['win_rate'] == 50.0
+    assert result['profit_factor'] == round(300 / 350, 3)
+    assert result['avg_holding_minutes'] == 30.0
+    assert result['by_strategy'] == {
+        'momentum': {'pnl': 0.0, 'trades': 3, 'win_rate': 66.67},
+        'mean_reversion': {'pnl': -50.0, 'trades': 1, 'win_rate': 0.0},
+    }
+    assert list(result['by_symbol'].items()) == [
+        ('TCS', {'pnl': 50.0, 'trades': 2, 'win_rate': 50.0}),
+        ('RELIANCE', {'pnl': -100.0, 'trades': 2, 'win_rate': 50.0}),
+    ]
+
+
+def test_failed_and_open_trades_are_excluded(analytics):
+    days = analytics.daily('paper')
+    assert '2024-03-07' not in days
+    assert sum(d['trades'] for d in days.values()) == 4
+    assert analytics.compute('live', CAPITAL)['total_pnl'] == 5000.0
+
+
+def test_closed_days_are_served_from_cache(app, analytics, db, monkeypatch):
+    reads = []
+    closed_trades = app.PortfolioAnalytics._closed_trades
+
+    def spy(cursor, account_type, since_day):
+        rows = closed_trades(cursor, account_type, since_day)
+        reads.append((since_day, [row[0] for row in rows]))
+        return rows
+
+    monkeypatch.setattr(app.PortfolioAnalytics, '_closed_trades', staticmethod(spy))
+    first = analytics.compute('paper', CAPITAL)
+    assert reads[0][0] is None and len(reads[0][1]) == 4
+
+    # A late write to a cached day is not re-read; a new close today is
+    _insert(db, [('late', 'INFY', 'momentum', 70.0, '2024-03-06 11:00:00', '2024-03-06 11:30:00', None),
+                 ('e', 'INFY', 'momentum', -20.0, '2024-03-08 11:00:00', '2024-03-08 11:05:00', None)])
+    second = analytics.compute('paper', CAPITAL)
+    assert reads[1] == ('2024-03-08', ['2024-03-08', '2024-03-08'])
+    assert second['equity_curve'][:-1] == first['equity_curve'][:-1]
+    assert second['equity_curve'][-1]['pnl'] == 80.0
+
+    analytics.invalidate('paper')
+    assert analytics.compute('paper', CAPITAL)['total_pnl'] == 0.0
+    assert reads[2][0] is None and len(reads[2][1]) == 6
+
+
+def test_analytics_endpoint(app, client, analytics, monkeypatch):
+    monkeypatch.setattr(app, 'ANALYTICS', analytics)
+    body = client.get('/api/analytics').get_json()['analytics']
+    # The paper account's default initial capital
+    assert body['initial_capital'] == 1000000.0 and body['trades'] == 4
+    assert client.get('/api/analytics?account_type=live&refresh=1').get_json()['analytics']['trades'] == 1
@@ -0,0 +1,104 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+TOKEN = 920001
+T0 = 1709523900  # 2024-03-04 03:45:00 UTC, on every interval's boundary
+
+
+@pytest.fixture
+def candles(app, monkeypatch):
+    builder = app.CandleBuilder(ring_size=3)
+    monkeypatch.setattr(app, 'CANDLES', builder)
+    monkeypatch.setitem(app.symbol_by_token, TOKEN, 'CTEST')
+    monkeypatch.setitem(app.token_by_symbol, 'CTEST', TOKEN)
+    return builder
+
+
+def _bars(builder, seconds):
+    return builder.get(TOKEN, seconds)[0]
+
+
+def test_bars_open_on_each_interval_boundary(candles):
+    for offset, price in ((0, 100.0), (30, 103.0), (59, 99.0), (60, 101.0), (299, 102.0), (300, 98.0),
+                          (899, 97.0), (900, 104.0)):
+        candles.update(TOKEN, T0 + offset, price)
+    assert [b[0] - T0 for b in _bars(candles, 60)] == [240, 300, 840, 900]
+    five = _bars(candles, 300)
+    assert [(b[0] - T0, b[1:5]) for b in five] == [(0, (100.0, 103.0, 99.0, 102.0)), (300, (98.0,) * 4),
+                                                   (600, (97.0,) * 4), (900, (104.0,) * 4)]
+    fifteen = _bars(candles, 900)
+    assert [(b[0] - T0, b[1:5]) for b in fifteen] == [(0, (100.0, 103.0, 97.0, 97.0)),
+                                                      (900, (104.0,) * 4)]
+    assert [b[0] - T0 for b in _bars(candles, 1)] == [299, 300, 899, 900]  # Ring of 3 plus the forming bar
+
+
+def test_volume_comes_from_cumulative_deltas(candles):
+    candles.update(TOKEN, T0, 100.0, 1000)      # First tick only sets the baseline
+    candles.update(TOKEN, T0 + 10, 100.5, 1200)
+    candles.update(TOKEN, T0 + 20, 100.2, 1150)  # A drop rebases (session reset) and adds nothing
+    candles.update(TOKEN, T0 + 61, 100.1, 1400)
+    minute = _bars(candles, 60)
+    assert [b[5] for b in minute] == [200, 250]
+    assert [b[5] for b in _bars(candles, 900)] == [450]
+
+
+def test_ring_evicts_oldest_and_ignores_late_ticks(candles):
+    for minute in range(6):
+        candles.update(TOKEN, T0 + 60 * minute, 100.0 + minute)
+    candles.update(TOKEN, T0 + 60, 1.0)  # Older than the forming bar
+    bars = _bars(candles, 60)
+    # Three completed bars in the ring plus the forming one
+    assert [b[0] - T0 for b in bars] == [120, 180, 240, 300]
+    assert min(b[3] for b in bars) == 102.0
+    assert [b[0] - T0 for b in candles.get(TOKEN, 60, since=T0 + 200)[0]] == [240, 300]
+
+
+def test_ticks_are_timed_by_exchange_timestamp(candles):
+    at = datetime.fromtimestamp(T0 + 125)
+    candles.persist = False
+    candles.on_ticks([{'instrument_token': TOKEN, 'last_price': 50.0, 'exchange_timestamp': at},
+                      {'instrument_token': TOKEN, 'last_price': 0}])
+    assert _bars(candles, 60) == [(T0 + 120, 50.0, 50.0, 50.0, 50.0, 0)]
+    assert candles.snapshot()['ticks'] == 1
+
+
+def test_completed_bars_flush_to_sqlite(candles, db):
+    for minute in range(3):
+        candles.update(TOKEN, T0 + 60 * minute, 100.0 + minute)
+    assert candles.snapshot()['pending_flush'] > 0
+    written = candles.flush()
+    rows = sqlite3.connect(db).execute("SELECT symbol, start_ts, close FROM candles WHERE interval = 60 "
+                                       "ORDER BY start_ts").fetchall()
+    assert rows == [('CTEST', T0, 100.0), ('CTEST', T0 + 60, 101.0)]
+    assert written == candles.flushed and candles.flush() == 0
+
+
+def test_failed_flush_keeps_the_bars(candles, db, monkeypatch):
+    candles.update(TOKEN, T0, 100.0)
+    candles.update(TOKEN, T0 + 60, 101.0)
+    pending = candles.snapshot()['pending_flush']
+    conn = sqlite3.connect(db)
+    conn.execute("DROP TABLE candles")
+    conn.commit()
+    with pytest.raises(sqlite3.OperationalError):
+        candles.flush()
+    assert candles.snapshot()['pending_flush'] == pending
+
+
+def test_endpoint_merges_sqlite_and_memory(app, client, candles, db):
+    for minute in range(8):
+        candles.update(TOKEN, T0 + 60 * minute, 100.0 + minute)
+    candles.flush()
+    body = client.get('/api/candles/ctest?interval=1m').get_json()
+    # Three in memory plus the forming one, preceded by at most ring_size flushed bars
+    assert body['source'] == 'memory+sqlite'
+    assert [c['time'] - T0 for c in body['candles']] == [60 * m for m in range(1, 8)]
+    older = client.get(f'/api/candles/CTEST?interval=1m&from={T0}').get_json()
+    assert older['candles'][0]['time'] == T0 + 60 and older['count'] == 7
+    recent = client.get(f'/api/candles/CTEST?interval=1m&from={T0 + 300}').get_json()
+    assert recent['source'] == 'memory' and recent['count'] == 3
+    assert client.get('/api/candles/CTEST?interval=2m').status_code == 400
+    assert client.get('/api/candles/CTEST?from=yesterday').status_code == 400
+    assert client.get('/api/candles/NOPE').status_code == 404
@@ -0,0 +1,95 @@
+import pytest
+
+TOKENS = {f"DTEST{i}": 910000 + i for i in range(6)}
+
+
+def _tick(token, bid, ask, bid_qty=(100,) * 5, ask_qty=(100,) * 5, step=0.05):
+    return {'instrument_token': token, 'last_price': bid,
+            'depth': {'buy': [{'price': round(bid - i * step, 2), 'quantity': q, 'orders': 1}
+                              for i, q in enumerate(bid_qty)],
+                      'sell': [{'price': round(ask + i * step, 2), 'quantity': q, 'orders': 1}
+                               for i, q in enumerate(ask_qty)]}}
+
+
+@pytest.fixture
+def depth(app, monkeypatch):
+    book = app.DepthBook(capacity=4)
+    monkeypatch.setattr(app, 'DEPTH', book)
+    for symbol, token in TOKENS.items():
+        monkeypatch.setitem(app.symbol_by_token, token, symbol)
+        monkeypatch.setitem(app.token_by_symbol, symbol, token)
+    return book
+
+
+def test_features_from_five_levels(depth):
+    token = TOKENS['DTEST0']
+    depth.track([token])
+    depth.on_ticks([_tick(token, 100.0, 100.1, bid_qty=(300, 100, 100, 100, 100), ask_qty=(100,) * 5)])
+    features = depth.get(token)
+    assert features['spread'] == pytest.approx(0.1)
+    assert features['mid'] == pytest.approx(100.05)
+    # Microprice leans towards the thinner side
+    assert features['weighted_mid'] == pytest.approx((100.0 * 100 + 100.1 * 300) / 400)
+    assert features['imbalance'] == pytest.approx(0.5)
+    assert 0 < features['pressure'] < features['imbalance']
+    assert [level['price'] for level in features['levels']['buy']] == [100.0, 99.95, 99.9, 99.85, 99.8]
+
+
+def test_short_depth_is_padded_and_one_sided_book_has_no_mid(depth):
+    token = TOKENS['DTEST0']
+    depth.track([token])
+    depth.on_ticks([{'instrument_token': token, 'depth': {'buy': [{'price': 50.0, 'quantity': 10}], 'sell': []}}])
+    features = depth.get(token)
+    assert features['mid'] is None and features['spread'] is None
+    assert features['imbalance'] == 1.0
+    assert features['levels'] == {'buy': [{'price': 50.0, 'quantity': 10.0}], 'sell': []}
+
+
+def test_untracked_and_stale_tokens(depth):
+    tracked, other = TOKENS['DTEST0'], TOKENS['DTEST1']
+    depth.track([tracked])
+    assert depth.get(tracked) is None  # Tracked but no tick yet
+    depth.on_ticks([_tick(other, 10.0, 10.1), _tick(tracked, 10.0, 10.1)])
+    assert depth.get(other) is None and depth.ticks == 1
+    depth.features[depth.rows[tracked], -1] -= 60
+    assert depth.get(tracked, max_age=10) is None
+    assert depth.get(tracked) is not None
+
+
+def test_grows_past_capacity_and_reuses_rows(depth):
+    tokens = list(TOKENS.values())
+    depth.track(tokens[:4])
+    depth.on_ticks([_tick(token, 100.0 + i, 100.1 + i) for i, token in enumerate(tokens[:4])])
+    depth.track(tokens[4:])
+    assert depth.capacity == 8
+    depth.on_ticks([_tick(tokens[5], 200.0, 200.1)])
+    # Rows written before the resize keep their values
+    assert [depth.get(token)['mid'] for token in tokens[:4]] == pytest.approx([100.05, 101.05, 102.05, 103.05])
+    assert depth.get(tokens[5])['mid'] == pytest.approx(200.05)
+    row = depth.rows[tokens[0]]
+    depth.untrack([tokens[0]])
+    depth.track([tokens[0]])
+    assert depth.rows[tokens[0]] == row and depth.get(tokens[0]) is None
+
+
+def test_depth_endpoints(client, depth):
+    response = client.post('/api/depth/track', json={'symbols': ['dtest2', 'NOPE']})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['symbols'] == ['DTEST2'] and body['unresolved'] == ['NOPE']
+    assert client.get('/api/depth/DTEST2').status_code == 404  # No depth yet
+    assert client.get('/api/depth/DTEST3').status_code == 404  # Not tracked
+    depth.on_ticks([_tick(TOKENS['DTEST2'], 99.0, 99.2)])
+    body = client.get('/api/depth/dtest2').get_json()
+    assert body['symbol'] == 'DTEST2' and body['features']['spread'] == pytest.approx(0.2)
+    assert client.delete('/api/depth/track', json={'symbols': ['DTEST2']}).get_json()['depth']['tracked'] == 0
+    assert client.post('/api/depth/track', json={}).status_code == 400
+
+
+def test_signal_uses_order_book_pressure(app, depth):
+    token = TOKENS['DTEST0']
+    depth.track([token])
+    depth.on_ticks([_tick(token, 100.0, 100.05, bid_qty=(900,) * 5, ask_qty=(100,) * 5)])
+    assert app.depth_features('dtest0')['pressure'] == pytest.approx(0.8)
+    signal = app.generate_ai_signal('DTEST0', {'current_price': 100.0, 'change_percent': 0})
+    assert 'Bid-heavy order book' in signal['reasons']
@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+import pytest
+
+DAY = 86400
+# Monday 2024-01-01 00:00 UTC
+MONDAY = 1704067200
+
+
+class FakeFetcher:
+    """Local stand-in for Yahoo: one bar per weekday, close = day number + version"""
+
+    def __init__(self):
+        self.calls = []
+        self.version = 0
+        self.fail = None
+        self.empty = False
+
+    def __call__(self, symbol, interval, start, end):
+        self.calls.append((start, end))
+        if self.fail:
+            raise self.fail
+        step = 86400 if interval == '1d' else 60
+        ts = np.arange(-(-start // step) * step, end if not self.empty else start, step, dtype=np.int64)
+        if interval == '1d':
+            ts = ts[np.is_busday(ts.astype('datetime64[s]').astype('datetime64[D]'))]
+        close = (ts // step).astype(np.float64) + self.version
+        return {'ts': ts, 'open': close, 'high': close + 1, 'low': close - 1, 'close': close,
+                'volume': np.full(len(ts), 100.0)}
+
+
+@pytest.fixture
+def store(app, tmp_path):
+    fetcher = FakeFetcher()
+    store = app.HistoricalStore(root=str(tmp_path / 'market_data'), fetcher=fetcher, live_refresh=300)
+    store.fake = fetcher
+    return store
+
+
+def test_gaps_around_covered_ranges(app):
+    gaps = app.HistoricalStore._gaps
+    assert gaps([], 0, 100) == [(0, 100)]
+    assert gaps([[10, 20], [40, 60]], 0, 100) == [(0, 10), (20, 40), (60, 100)]
+    assert gaps([[0, 50]], 10, 40) == []
+    assert gaps([[0, 50], [80, 200]], 30, 90) == [(50, 80)]
+    cover = app.HistoricalStore._cover
+    assert cover([[0, 10], [30, 40]], 10, 30) == [[0, 40]]
+
+
+def test_repeated_lookup_is_served_without_fetching(store):
+    first = store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 14 * DAY)
+    assert len(first['ts']) == 10 and not first['stale']
+    again = store.get_bars('INFY.NS', '1d', MONDAY + 2 * DAY, MONDAY + 9 * DAY)
+    assert len(store.fake.calls) == 1 and store.hits == 1
+    assert again['ts'].tolist() == [t for t in first['ts'].tolist() if MONDAY + 2 * DAY <= t < MONDAY + 9 * DAY]
+
+
+def test_adjacent_ranges_append_and_only_fetch_the_gap(store):
+    store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 7 * DAY)
+    bars = store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 21 * DAY)
+    assert store.fake.calls[-1] == (MONDAY + 7 * DAY, MONDAY + 21 * DAY)
+    assert len(bars['ts']) == 15 and (np.diff(bars['ts']) > 0).all()
+
+
+def test_overlapping_fetch_replaces_stored_bars(app, store):
+    store.get_bars('INFY.NS', '1d', MONDAY + 7 * DAY, MONDAY + 14 * DAY)
+    store.fake.version = 1000
+    bars = store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 21 * DAY)
+    ts = bars['ts'].tolist()
+    assert len(ts) == len(set(ts)) == 15 and ts == sorted(ts)
+    # Only the gaps were fetched; the stored middle week keeps its values
+    assert store.fake.calls[1:] == [(MONDAY, MONDAY + 7 * DAY), (MONDAY + 14 * DAY, MONDAY + 21 * DAY)]
+    assert bars['close'][5] == (MONDAY + 7 * DAY) // DAY
+    assert bars['close'][0] == MONDAY // DAY + 1000
+    # A direct overlapping merge: newer values win
+    directory = store._dir('INFY.NS', '1d')
+    newer = store.fake('INFY.NS', '1d', MONDAY + 7 * DAY, MONDAY + 9 * DAY)
+    newer['close'] = newer['close'] + 0.5
+    store._merge(directory, newer)
+    merged = store._load(directory)
+    assert len(merged['ts']) == 15
+    assert merged['close'][5] == (MONDAY + 7 * DAY) // DAY + 1000.5
+
+
+def test_live_window_is_refetched_after_live_refresh(store):
+    now = int(time.time())
+    store.get_bars('INFY.NS', '1m', now - 3600)
+    # Settled history and the still-forming last minute are fetched separately
+    assert len(store.fake.calls) == 2
+    store.get_bars('INFY.NS', '1m', now - 3600)
+    assert len(store.fake.calls) == 2
+    store.live_refresh = 0
+    store.get_bars('INFY.NS', '1m', now - 3600)
+    # Settled history stays covered; only the live window is asked for again
+    assert len(store.fake.calls) == 3 and store.fake.calls[-1][0] >= now - 120
+
+
+def test_provider_outage_serves_stored_bars_as_stale(app, store):
+    store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 7 * DAY)
+    store.fake.fail = app.UpstreamUnavailable('yahoo', 'timed out')
+    bars = store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 14 * DAY)
+    assert bars['stale'] and len(bars['ts']) == 5
+    store.fake.fail = None
+    bars = store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 14 * DAY)
+    assert not bars['stale'] and len(bars['ts']) == 10
+
+
+def test_empty_answers_are_cached_only_without_trading_days(store):
+    store.fake.empty = True
+    # A weekend with no bars is genuinely empty
+    store.get_bars('INFY.NS', '1d', MONDAY + 5 * DAY, MONDAY + 7 * DAY)
+    store.get_bars('INFY.NS', '1d', MONDAY + 5 * DAY, MONDAY + 7 * DAY)
+    assert len(store.fake.calls) == 1
+    # Weekdays with no bars are asked for again
+    store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 5 * DAY)
+    store.get_bars('INFY.NS', '1d', MONDAY, MONDAY + 5 * DAY)
+    assert len(store.fake.calls) == 3
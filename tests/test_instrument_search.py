@@ -0,0 +1,96 @@
+import logging
+import sqlite3
+
+import pytest
+
+MASTER = [
+    (1, 'RELIANCE', 'RELIANCE INDUSTRIES', 'NSE', 'NSE', 'EQ'),
+    (2, 'RELIANCE', 'RELIANCE INDUSTRIES', 'BSE', 'BSE', 'EQ'),
+    (3, 'RELIANCE24MARFUT', 'RELIANCE INDUSTRIES', 'NFO', 'NFO-FUT', 'FUT'),
+    (4, 'RELIANCE24MAR2900CE', 'RELIANCE INDUSTRIES', 'NFO', 'NFO-OPT', 'CE'),
+    (5, 'RELIANCE24MAR2900PE', 'RELIANCE INDUSTRIES', 'NFO', 'NFO-OPT', 'PE'),
+    (6, 'RELINFRA', 'RELIANCE INFRASTRUCTURE', 'NSE', 'NSE', 'EQ'),
+    (7, 'TCS', 'TATA CONSULTANCY SERVICES', 'NSE', 'NSE', 'EQ'),
+    (8, 'TATAMOTORS', 'TATA MOTORS', 'NSE', 'NSE', 'EQ'),
+    (9, 'HDFCBANK', 'HDFC BANK', 'NSE', 'NSE', 'EQ'),
+    (10, 'HDFCBANK', 'HDFC BANK', 'BSE', 'BSE', 'EQ'),
+]
+
+
+@pytest.fixture
+def index(app):
+    return app.InstrumentIndex([
+        {'instrument_token': token, 'tradingsymbol': symbol.lower(), 'name': name, 'exchange': exchange,
+         'segment': segment, 'instrument_type': kind, 'lot_size': 1}
+        for token, symbol, name, exchange, segment, kind in MASTER
+    ] + [{'instrument_token': 11, 'tradingsymbol': ''}])
+
+
+def _found(results):
+    return [(r['instrument_token'], r['match']) for r in results]
+
+
+def test_exact_symbols_rank_before_prefixes_and_names(index):
+    results = index.search('reliance', limit=10)
+    assert _found(results)[:2] == [(1, 'exact'), (2, 'exact')]
+    # Then longer symbols (derivatives) by length, then the name prefix match
+    assert [r['instrument_token'] for r in results[2:6]] == [3, 4, 5, 6]
+    assert results[5]['score'] == 0.9
+    assert _found(index.search('RELIANCE', limit=1)) == [(1, 'exact')]
+    assert len(index) == 10
+
+
+def test_segment_and_type_filters(index):
+    assert _found(index.search('RELIANCE', segment='nfo-opt', instrument_type='ce')) == [(4, 'prefix')]
+    # segment matches an exchange too
+    assert {r['instrument_token'] for r in index.search('RELIANCE', segment='NFO')} == {3, 4, 5}
+    assert _found(index.search('HDFCBANK', segment='BSE')) == [(10, 'exact')]
+    assert [r['instrument_token'] for r in index.search('TATA', instrument_type='EQ')][:2] == [8, 7]
+    assert index.search('RELIANCE', segment='MCX') == []
+
+
+def test_typos_recover_through_fuzzy_matching(index):
+    results = index.search('RELAINCE', limit=3)
+    assert results[0]['tradingsymbol'] == 'RELIANCE' and results[0]['match'] == 'fuzzy'
+    assert 0.3 <= results[0]['score'] < 1
+    assert index.search('TATA CONSULTNCY')[0]['tradingsymbol'] == 'TCS'
+    assert _found(index.search('HDFC BNAK', segment='BSE')) == [(10, 'fuzzy')]
+    # Option symbols are not fuzzy keys; their underlying name is
+    assert {r['segment'] for r in index.search('RELAINCE INDUSTRIES', segment='NFO-OPT')} == {'NFO-OPT'}
+    assert index.search('ZZZQQ') == []
+    assert index.suggest('HDFCBNK') == ['HDFCBANK', 'HDFCBANK']
+
+
+def test_search_endpoint(app, client, index, monkeypatch):
+    monkeypatch.setattr(app, 'INSTRUMENT_INDEX', index)
+    body = client.get('/api/instruments/search?q=tcs&segment=NSE').get_json()
+    assert body['count'] == 1 and body['results'][0]['instrument_token'] == 7
+    assert client.get('/api/instruments/search?q=').status_code == 400
+    assert client.get('/api/instruments/search?q=tcs&limit=x').status_code == 400
+
+
+class _Subscriptions:
+    def __init__(self):
+        self.owners = {}
+
+    def replace(self, owner, tokens, mode='quote'):
+        self.owners[owner] = list(tokens)
+
+    def release(self, owner):
+        self.owners.pop(owner, None)
+
+
+def test_unresolved_allowed_symbols_are_logged_with_suggestions(app, db, index, monkeypatch, caplog):
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE ai_trading_settings SET allowed_symbols = 'RELIANCE, RELAINCE,,TCS' WHERE user_id = 'default'")
+    conn.commit()
+    subscriptions = _Subscriptions()
+    monkeypatch.setattr(app, 'INSTRUMENT_INDEX', index)
+    monkeypatch.setattr(app, 'SUBSCRIPTIONS', subscriptions)
+    monkeypatch.setattr(app, 'AI_TRADING_ACTIVE', True)
+    monkeypatch.setattr(app, 'token_by_symbol', {'RELIANCE': 1, 'TCS': 7})
+    with caplog.at_level(logging.WARNING, logger='app'):
+        app.sync_default_subscriptions()
+    assert subscriptions.owners['ai_engine'] == [1, 7]
+    warnings = [r.getMessage() for r in caplog.records if 'Allowed symbol' in r.getMessage()]
+    assert len(warnings) == 1 and 'RELAINCE' in warnings[0] and "'RELIANCE'" in warnings[0]
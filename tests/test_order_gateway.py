@@ -0,0 +1,268 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+from kiteconnect import KiteConnect
+from kiteconnect import exceptions as kite_exceptions
+from urllib3.exceptions import NewConnectionError
+
+from conftest import wait_for
+
+
+class FakeBroker:
+    """KiteConnect stand-in: place_order runs the scripted outcomes in turn, then succeeds"""
+
+    def __init__(self, outcomes=()):
+        self.outcomes = list(outcomes)
+        self.placed = []
+        self.book = []
+        self.cancelled = []
+        self.lock = threading.Lock()
+
+    def place_order(self, variety, **params):
+        with self.lock:
+            outcome = self.outcomes.pop(0) if self.outcomes else 'ok'
+            if outcome in ('ok', 'accepted_then_timeout'):
+                order_id = f"O{len(self.book) + 1}"
+                self.book.append({'order_id': order_id, 'tag': params.get('tag')})
+                self.placed.append(params)
+                if outcome == 'ok':
+                    return order_id
+                raise requests.exceptions.ReadTimeout("read timed out")
+            raise outcome
+
+    def cancel_order(self, variety, **params):
+        self.cancelled.append(params['order_id'])
+        return params['order_id']
+
+    def orders(self):
+        with self.lock:
+            return list(self.book)
+
+
+def _gateway(app, broker, **kwargs):
+    return app.OrderGateway(client=broker, rate=1000, workers=1, backoff=0.01, **kwargs), []
+
+
+def _entry():
+    return {'exchange': 'NSE', 'tradingsymbol': 'INFY', 'transaction_type': 'BUY', 'quantity': 1,
+            'product': 'MIS', 'order_type': 'MARKET'}
+
+
+def test_entry_is_tagged_and_acked(app):
+    broker = FakeBroker()
+    gateway, acks = _gateway(app, broker)
+    request_id = gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: acks)
+    assert acks[0]['status'] == 'ACKED' and acks[0]['order_id'] == 'O1'
+    assert broker.placed[0]['tag'] == request_id
+    gateway.stop()
+
+
+def test_read_timeout_after_acceptance_is_not_placed_twice(app):
+    broker = FakeBroker(['accepted_then_timeout'])
+    gateway, acks = _gateway(app, broker)
+    gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: acks)
+    assert acks[0]['status'] == 'ACKED' and acks[0]['order_id'] == 'O1'
+    assert len(broker.placed) == 1
+    gateway.stop()
+
+
+def test_refused_connection_is_retried(app):
+    refused = requests.exceptions.ConnectionError(NewConnectionError(None, "connection refused"))
+    broker = FakeBroker([refused])
+    gateway, acks = _gateway(app, broker)
+    gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: acks)
+    assert acks[0]['status'] == 'ACKED' and acks[0]['attempts'] == 2
+    assert len(broker.placed) == 1
+    gateway.stop()
+
+
+def test_rejection_fails_without_retry(app):
+    broker = FakeBroker([kite_exceptions.InputException("insufficient margin")])
+    gateway, acks = _gateway(app, broker)
+    gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: acks)
+    assert acks[0]['status'] == 'FAILED' and acks[0]['attempts'] == 1
+    assert 'insufficient margin' in acks[0]['error']
+    assert gateway.snapshot()['retried'] == 0
+    gateway.stop()
+
+
+def test_retries_are_bounded(app):
+    refused = requests.exceptions.ConnectTimeout("connect timed out")
+    broker = FakeBroker([refused] * 10)
+    gateway, acks = _gateway(app, broker, max_retries=2)
+    gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: acks)
+    assert acks[0]['status'] == 'FAILED' and acks[0]['attempts'] == 3
+
+
+def test_cancels_jump_the_queue(app):
+    broker = FakeBroker()
+    gateway, acks = _gateway(app, broker)
+    sent = []
+    broker.place_order = lambda variety, **params: sent.append('ENTRY') or 'O'
+    broker.cancel_order = lambda variety, **params: sent.append('CANCEL') or params['order_id']
+    # Queue everything before any worker runs, then let them drain in priority order
+    gateway.running = True
+    for _ in range(3):
+        gateway.submit('ENTRY', _entry())
+    gateway.submit('CANCEL', {'order_id': 'X'})
+    gateway.running = False
+    gateway.start()
+    assert wait_for(lambda: len(sent) == 4)
+    assert sent[0] == 'CANCEL'
+    gateway.stop()
+
+
+def test_withdraw_reports_through_on_ack(app):
+    broker = FakeBroker()
+    gateway, acks = _gateway(app, broker)
+    gateway.running = True  # Accept submissions without starting workers
+    request_id = gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert gateway.withdraw(request_id)
+    assert acks and acks[0]['status'] == 'WITHDRAWN'
+    assert not gateway.withdraw(request_id)
+
+
+def test_unknown_kind_is_rejected(app):
+    with pytest.raises(ValueError):
+        app.OrderGateway(client=FakeBroker()).submit('BOGUS', {})
+
+
+@pytest.fixture
+def broker_api(app, client, monkeypatch):
+    broker = FakeBroker()
+    monkeypatch.setattr(app, '_ensure_kite_connected', lambda: True)
+    monkeypatch.setattr(app, 'ORDER_GATEWAY', app.OrderGateway(client=broker, rate=1000, workers=1, backoff=0.01))
+    account = app.RISK_ENGINE._account('real')
+    account.capital = account.balance = 1000000.0
+    yield broker
+    app.ORDER_GATEWAY.stop()
+
+
+def test_broker_orders_reject_unknown_params(client, broker_api):
+    response = client.post('/api/zerodha/orders', json={'kind': 'ENTRY', 'params': {**_entry(), 'price': 100,
+                                                                                   'disclosed_quantity': 5}})
+    assert response.status_code == 400
+    assert 'disclosed_quantity' in response.get_json()['error']
+    response = client.post('/api/zerodha/orders', json={'kind': 'MODIFY', 'params': {'order_id': 'O1', 'quantity': 9}})
+    assert response.status_code == 400
+
+
+def test_broker_orders_are_risk_checked(app, client, broker_api):
+    response = client.post('/api/zerodha/orders', json={'kind': 'ENTRY', 'params': {**_entry(), 'quantity': 100000,
+                                                                                   'order_type': 'LIMIT', 'price': 100}})
+    assert response.status_code == 400 and response.get_json()['risk_rejected']
+    assert not broker_api.placed
+
+
+def test_failed_broker_order_releases_its_reservation(app, client, broker_api):
+    broker_api.outcomes = [kite_exceptions.InputException("rejected")]
+    response = client.post('/api/zerodha/orders', json={'kind': 'ENTRY', 'params': {**_entry(), 'quantity': 10,
+                                                                                   'order_type': 'LIMIT', 'price': 100}})
+    assert response.status_code == 202
+    request_id = response.get_json()['request_id']
+    assert wait_for(lambda: app.ORDER_GATEWAY.status(request_id)['status'] == 'FAILED')
+    assert wait_for(lambda: app.RISK_ENGINE._account('real').exposure == 0)
+
+
+def test_token_bucket_rate_and_timeout(app):
+    bucket = app.TokenBucket(rate=20, capacity=2)
+    assert bucket.acquire(timeout=0) and bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.01)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # Five tokens at 20/s take about a quarter of a second once the burst is spent
+    assert 0.2 <= time.monotonic() - started < 0.5
+    bucket.refund()
+    assert bucket.acquire(timeout=0)
+
+
+class _KiteOrderApi(BaseHTTPRequestHandler):
+    """Kite order endpoints that allow `limit` accepted orders in any rolling second, then answer 429"""
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_qs(self.rfile.read(length).decode())
+        with server.lock:
+            now = time.monotonic()
+            while server.window and now - server.window[0] >= 1.0:
+                server.window.popleft()
+            if len(server.window) >= server.limit:
+                server.rejected += 1
+                return self._reply(429, {'status': 'error', 'error_type': 'NetworkException',
+                                         'message': 'Too many requests'})
+            server.window.append(now)
+            server.peak = max(server.peak, len(server.window))
+            order_id = f"O{len(server.placed) + 1}"
+            server.placed.append({'order_id': order_id, 'tag': params.get('tag', [None])[0]})
+        self._reply(200, {'status': 'success', 'data': {'order_id': order_id}})
+
+    def do_GET(self):
+        with self.server.lock:
+            self._reply(200, {'status': 'success', 'data': list(self.server.placed)})
+
+
+@pytest.fixture
+def kite_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _KiteOrderApi)
+    server.lock, server.window, server.placed = threading.Lock(), deque(), []
+    server.limit, server.rejected, server.peak = 20, 0, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _kite_client(server):
+    return KiteConnect(api_key='test', access_token='token', root=f"http://127.0.0.1:{server.server_address[1]}")
+
+
+def test_gateway_stays_under_the_broker_limit(app, kite_api):
+    # Configured a little under the broker's 20/s, as ORDER_RATE_LIMIT should be
+    gateway = app.OrderGateway(client=_kite_client(kite_api), rate=18, workers=4, backoff=0.05)
+    acks = []
+    for _ in range(45):
+        gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: len(acks) == 45, timeout=10)
+    gateway.stop()
+    assert all(ack['status'] == 'ACKED' for ack in acks)
+    assert kite_api.rejected == 0 and kite_api.peak <= kite_api.limit
+    assert len(kite_api.placed) == 45
+
+
+def test_gateway_retries_broker_429s(app, kite_api):
+    # Twice the broker's limit with a burst: the broker pushes back and every order still goes through once
+    gateway = app.OrderGateway(client=_kite_client(kite_api), rate=40, burst=40, workers=4, backoff=0.1,
+                               max_retries=6)
+    acks = []
+    for _ in range(60):
+        gateway.submit('ENTRY', _entry(), on_ack=acks.append)
+    assert wait_for(lambda: len(acks) == 60, timeout=15)
+    gateway.stop()
+    assert kite_api.rejected > 0 and gateway.snapshot()['retried'] >= kite_api.rejected
+    assert all(ack['status'] == 'ACKED' for ack in acks)
+    tags = [order['tag'] for order in kite_api.placed]
+    assert len(tags) == len(set(tags)) == 60
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+
+def _ids(generator, count):
+    return [generator.next_id() for _ in range(count)]
+
+
+def test_ids_are_unique_and_increasing_across_threads(app):
+    generator = app.OrderIdGenerator(worker_id=5)
+    per_thread = {}
+
+    def run(name):
+        per_thread[name] = _ids(generator, 5000)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    every = [i for ids in per_thread.values() for i in ids]
+    assert len(set(every)) == 40000
+    assert all(ids == sorted(ids) for ids in per_thread.values())
+    assert {(i >> app.OrderIdGenerator.SEQUENCE_BITS) & 1023 for i in every} == {5}
+
+
+def test_sequence_rollover_borrows_the_next_millisecond(app, monkeypatch):
+    generator = app.OrderIdGenerator(worker_id=1)
+    monkeypatch.setattr(app.time, 'time', lambda: 1760000000.0005)
+    ids = _ids(generator, 3 * 4096 + 10)
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    shift = app.OrderIdGenerator.WORKER_BITS + app.OrderIdGenerator.SEQUENCE_BITS
+    millis = sorted({i >> shift for i in ids})
+    assert len(millis) == 4 and millis[-1] - millis[0] == 3
+
+
+def test_clock_stepping_back_stays_monotonic(app, monkeypatch):
+    generator = app.OrderIdGenerator(worker_id=1)
+    clock = iter([1760000000.5, 1760000000.4, 1760000000.3, 1760000000.6])
+    monkeypatch.setattr(app.time, 'time', lambda: next(clock))
+    ids = _ids(generator, 4)
+    assert ids == sorted(ids) and len(set(ids)) == 4
+
+
+def test_worker_ids_come_from_distinct_slots(app, tmp_path, monkeypatch):
+    monkeypatch.delenv('WORKER_ID', raising=False)
+    monkeypatch.setenv('WORKER_ID_DIR', str(tmp_path))
+    first, second = app.OrderIdGenerator(), app.OrderIdGenerator()
+    first.next_id(), second.next_id()
+    assert first.worker_id != second.worker_id
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # A forked worker must not keep the parent's slot
+        first.next_id()
+        os.write(write, str(first.worker_id).encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    child = int(os.read(read, 16))
+    assert child not in (first.worker_id, second.worker_id)
+
+    monkeypatch.setenv('WORKER_ID', '77')
+    explicit = app.OrderIdGenerator()
+    explicit.next_id()
+    assert explicit.worker_id == 77
+
+
+def _order(**overrides):
+    return {'symbol': 'INFY', 'side': 'BUY', 'quantity': 1, 'price': 100, **overrides}
+
+
+def _trade_count(db):
+    return sqlite3.connect(db).execute("SELECT COUNT(*) FROM trades").fetchone()[0]
+
+
+def test_idempotency_key_and_client_order_id_replay(client, db):
+    first = client.post('/api/place-order', json=_order(), headers={'Idempotency-Key': 'k-1'}).get_json()
+    again = client.post('/api/place-order', json=_order(), headers={'Idempotency-Key': 'k-1'}).get_json()
+    assert not first['duplicate'] and again['duplicate'] and again['trade_id'] == first['trade_id']
+    by_body = client.post('/api/place-order', json=_order(client_order_id='k-2')).get_json()
+    # The key in the body and the header share one namespace
+    header = client.post('/api/place-order', json=_order(), headers={'Idempotency-Key': 'k-2'}).get_json()
+    assert header['duplicate'] and header['trade_id'] == by_body['trade_id']
+    assert _trade_count(db) == 2
+
+
+def test_bulk_replays_and_in_batch_duplicates(client, db):
+    client.post('/api/place-order', json=_order(client_order_id='old'))
+    body = client.post('/api/place-orders', json={'orders': [
+        _order(client_order_id='old'), _order(client_order_id='a'), _order(client_order_id='a'), _order()
+    ]}).get_json()
+    results = body['orders']
+    assert body['placed'] == 2 and body['duplicates'] == 2
+    assert results[0]['duplicate'] and results[2]['duplicate']
+    assert results[2]['trade_id'] == results[1]['trade_id']
+    assert _trade_count(db) == 3
+
+
+def test_bulk_is_all_or_nothing_when_a_risk_check_fails(app, client, db):
+    account = app.RISK_ENGINE._account('paper')
+    exposure = account.exposure
+    response = client.post('/api/place-orders', json={'orders': [
+        _order(client_order_id='b1'), _order(quantity=100000, price=1000), _order(client_order_id='b2')
+    ]})
+    body = response.get_json()
+    assert response.status_code == 400 and body['risk_rejected']
+    assert [e['index'] for e in body['errors']] == [1]
+    assert _trade_count(db) == 0 and account.exposure == exposure
+    # The keys were not used up by the rejected batch
+    assert client.post('/api/place-orders', json={'orders': [_order(client_order_id='b1')]}).get_json()['placed'] == 1
+
+
+def test_bulk_validation_reports_every_bad_order(client, db):
+    response = client.post('/api/place-orders', json={'orders': [_order(), _order(side='HOLD'), 'x']})
+    assert response.status_code == 400
+    assert [e['index'] for e in response.get_json()['errors']] == [1, 2]
+    assert _trade_count(db) == 0
+    assert client.post('/api/place-orders', json={'orders': []}).status_code == 400
+
+
+@pytest.mark.parametrize('key', ['', '   ', 'x' * 65, 7, ['k']])
+def test_bad_client_order_ids_are_rejected(client, key):
+    assert client.post('/api/place-order', json=_order(client_order_id=key)).status_code == 400
@@ -0,0 +1,119 @@
+import sqlite3
+import time
+
+import pytest
+
+from conftest import wait_for
+
+TOKEN = 900001
+
+
+def _depth(bid, ask, quantity=100, levels=5, step=0.05):
+    return {'buy': [{'price': round(bid - i * step, 2), 'quantity': quantity, 'orders': 1} for i in range(levels)],
+            'sell': [{'price': round(ask + i * step, 2), 'quantity': quantity, 'orders': 1} for i in range(levels)]}
+
+
+@pytest.fixture
+def exchange(app, db, monkeypatch):
+    books = []
+    exchange = app.PaperExchange(on_book=lambda symbol, active: books.append((symbol, active)))
+    exchange.book_events = books
+    monkeypatch.setattr(app, 'PAPER_EXCHANGE', exchange)
+    monkeypatch.setitem(app.symbol_by_token, TOKEN, 'PTEST')
+    monkeypatch.setitem(app.token_by_symbol, 'PTEST', TOKEN)
+    yield exchange
+    # Let the fill writer finish before the next test moves to another database
+    wait_for(exchange.fill_queue.empty)
+    time.sleep(0.05)
+
+
+def _tick(exchange, last_price, depth=None):
+    exchange.on_ticks([{'instrument_token': TOKEN, 'last_price': last_price, 'depth': depth}])
+
+
+def test_limit_order_walks_the_book_across_ticks(exchange):
+    order = exchange.submit('PTEST', 'BUY', 250, 'LIMIT', 100.07)
+    assert order.status == 'OPEN'
+    _tick(exchange, 100.0, _depth(99.95, 100.0))
+    # 100 @ 100.00 and 100 @ 100.05; 100.10 is above the limit
+    assert order.filled == 200 and order.status == 'PARTIAL'
+    assert round(order.notional / order.filled, 3) == 100.025
+    _tick(exchange, 100.0, _depth(99.95, 100.0))
+    assert order.status == 'FILLED'
+
+
+def test_resting_order_waits_for_a_marketable_price(exchange):
+    order = exchange.submit('PTEST', 'SELL', 10, 'LIMIT', 101.0)
+    _tick(exchange, 100.0, _depth(99.95, 100.0))
+    assert order.filled == 0
+    _tick(exchange, 101.2, _depth(101.1, 101.2))
+    assert order.status == 'FILLED' and order.notional == 10 * 101.1
+
+
+def test_stop_order_triggers_then_fills(exchange):
+    _tick(exchange, 100.0, _depth(99.95, 100.0))
+    order = exchange.submit('PTEST', 'SELL', 50, 'STOP', trigger_price=99.0)
+    _tick(exchange, 99.5, _depth(99.45, 99.5))
+    assert order.status == 'PENDING'
+    _tick(exchange, 98.9, _depth(98.85, 98.9))
+    assert order.status == 'FILLED' and order.notional == 50 * 98.85
+
+
+def test_ticks_without_depth_fill_at_last_price(exchange):
+    order = exchange.submit('PTEST', 'BUY', 5, 'LIMIT', 100.0)
+    _tick(exchange, 99.5)
+    assert order.status == 'FILLED' and order.notional == 5 * 99.5
+
+
+def test_cancel_releases_unfilled_risk(app, exchange):
+    order = exchange.submit('PTEST', 'BUY', 10, 'LIMIT', 90.0)
+    assert app.RISK_ENGINE._account('paper').exposure == 900.0
+    assert exchange.cancel(order.order_id).status == 'CANCELLED'
+    assert app.RISK_ENGINE._account('paper').exposure == 0
+
+
+def test_fills_are_written_as_trades(exchange, db):
+    exchange.submit('PTEST', 'BUY', 10, 'LIMIT', 100.0)
+    _tick(exchange, 100.0, _depth(99.95, 100.0))
+    count = lambda: sqlite3.connect(db).execute("SELECT COUNT(*), SUM(quantity) FROM trades "
+                                                "WHERE symbol = 'PTEST'").fetchone()
+    assert wait_for(lambda: count() == (1, 10))
+
+
+def test_failed_fill_writes_are_retried_not_dropped(exchange, db, monkeypatch):
+    exchange.retry_delay = 0.01
+    insert, attempts = exchange._insert_fills, []
+
+    def flaky(rows):
+        attempts.append([row[0] for row in rows])
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        insert(rows)
+
+    monkeypatch.setattr(exchange, '_insert_fills', flaky)
+    order = exchange.submit('PTEST', 'BUY', 10, 'LIMIT', 100.0)
+    _tick(exchange, 100.0, _depth(99.95, 100.0))
+    rows = lambda: sqlite3.connect(db).execute("SELECT trade_id, quantity FROM trades WHERE symbol = 'PTEST'").fetchall()
+    assert wait_for(lambda: len(rows()) == 1)
+    # The same trade id on every attempt, written exactly once
+    assert len(attempts) == 3 and attempts[0] == attempts[2] and rows() == [(attempts[0][0], 10)]
+    assert exchange.snapshot()['fill_write_retries'] == 2
+    assert wait_for(lambda: order.order_id in exchange.finished)
+
+
+def test_subscription_follows_resting_orders(exchange):
+    first = exchange.submit('PTEST', 'BUY', 1, 'LIMIT', 90.0)
+    exchange.cancel(first.order_id)
+    second = exchange.submit('PTEST', 'BUY', 1, 'LIMIT', 90.0)
+    assert exchange.book_events == [('PTEST', True), ('PTEST', False), ('PTEST', True)]
+    _tick(exchange, 89.0)
+    assert wait_for(lambda: exchange.book_events[-1] == ('PTEST', False))
+    assert second.status == 'FILLED'
+
+
+def test_paper_orders_endpoint_validation(client):
+    response = client.post('/api/paper/orders', json={'symbol': 'PTEST', 'side': 'BUY', 'quantity': 1,
+                                                      'order_type': 'STOP_LIMIT', 'price': 90})
+    assert response.status_code == 400 and 'trigger_price' in response.get_json()['error']
+    response = client.post('/api/paper/orders', json={'symbol': 'PTEST', 'side': 'HOLD', 'quantity': 1, 'price': 1})
+    assert response.status_code == 400
@@ -0,0 +1,182 @@
+import threading
+import time
+
+import pytest
+
+from conftest import wait_for
+
+SYMBOLS = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE', 'FFF']
+
+
+def _settings(daily_limit=100, frequency=30):
+    settings = [None] * 14
+    settings[3], settings[4], settings[5], settings[9] = 'paper', 10000, daily_limit, frequency
+    return tuple(settings)
+
+
+def _tick(symbol, price=101.0):
+    return {'instrument_token': SYMBOLS.index(symbol) + 1, 'last_price': price, 'ohlc': {'close': 100.0}}
+
+
+class _Risk:
+    def __init__(self):
+        self.trades = 0
+        self.released = []
+
+    def daily_trades(self, account_type, strategy):
+        return self.trades
+
+    def release(self, account_type, symbol, side, quantity, price, strategy, debit):
+        self.released.append(symbol)
+
+
+class _Stages:
+    """Stand-ins for the signal, reservation and order calls the stages make"""
+
+    def __init__(self):
+        self.evaluated = []
+        self.reserved = []
+        self.submitted = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.submit_delay = 0.0
+
+    def signal(self, symbol, market_data):
+        self.evaluated.append((symbol, market_data['current_price']))
+        return {'symbol': symbol, 'signal': 'BUY', 'confidence': 90, 'current_price': market_data['current_price']}
+
+    def reserve(self, signal, settings):
+        self.reserved.append(signal['symbol'])
+        return 1, None
+
+    def submit(self, signal, settings, quantity):
+        self.gate.wait()
+        time.sleep(self.submit_delay)
+        self.submitted.append(signal['symbol'])
+
+
+@pytest.fixture
+def stages(app, monkeypatch):
+    stages = _Stages()
+    monkeypatch.setattr(app, 'symbol_by_token', {i + 1: s for i, s in enumerate(SYMBOLS)})
+    monkeypatch.setattr(app, 'RISK_ENGINE', _Risk())
+    monkeypatch.setattr(app, 'generate_ai_signal', stages.signal)
+    monkeypatch.setattr(app, '_reserve_ai_trade', stages.reserve)
+    monkeypatch.setattr(app, '_submit_ai_trade', stages.submit)
+    return stages
+
+
+@pytest.fixture
+def make_pipeline(app, stages):
+    pipelines = []
+
+    def make(**kwargs):
+        pipeline = app.TradingPipeline(**kwargs)
+        pipeline.configure(_settings(), SYMBOLS)
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    stages.gate.set()
+    for pipeline in pipelines:
+        pipeline.stop()
+        for thread in pipeline.threads:
+            thread.join(timeout=2)
+
+
+def test_ticks_conflate_per_symbol_and_drop_past_max_pending(make_pipeline):
+    pipeline = make_pipeline(max_pending=2)
+    pipeline.running = True  # Accept ticks without stage threads consuming them
+    pipeline.on_ticks([_tick('AAA', 101), _tick('BBB', 102), _tick('AAA', 103), _tick('CCC', 104),
+                       {'instrument_token': 99, 'last_price': 1.0}, {'instrument_token': 4}])
+    pipeline.on_ticks([_tick('BBB', 105), _tick('DDD', 106)])
+    # AAA keeps its place in line with its newest tick; CCC and DDD found the buffer full
+    assert [(s, e['tick']['last_price']) for s, e in pipeline.pending.items()] == [('AAA', 103), ('BBB', 105)]
+    counters = pipeline.snapshot()
+    assert (counters['ticks'], counters['conflated'], counters['dropped']) == (6, 2, 2)
+
+
+def test_signals_flow_through_and_put_the_symbol_in_cooldown(make_pipeline, stages):
+    pipeline = make_pipeline()
+    pipeline.start()
+    pipeline.on_ticks([_tick('AAA', 101), _tick('BBB', 102)])
+    assert wait_for(lambda: pipeline.counters['orders'] == 2)
+    assert stages.submitted == ['AAA', 'BBB']
+    # One decision per symbol per trading cycle (settings[9] seconds)
+    pipeline.on_ticks([_tick('AAA', 110), _tick('BBB', 111)])
+    assert pipeline.counters['cooling_down'] == 2 and not pipeline.pending
+    assert pipeline.cooldown_until['AAA'] - time.time() == pytest.approx(30, abs=1)
+    pipeline.cooldown_until['AAA'] = time.time() - 1
+    pipeline.on_ticks([_tick('AAA', 112)])
+    assert wait_for(lambda: pipeline.counters['orders'] == 3)
+    assert stages.evaluated[-1] == ('AAA', 112)
+
+
+def test_daily_limit_rejects_before_reserving(app, make_pipeline, stages):
+    pipeline = make_pipeline()
+    pipeline.configure(_settings(daily_limit=1), SYMBOLS)
+    app.RISK_ENGINE.trades = 1
+    pipeline.start()
+    pipeline.on_ticks([_tick('AAA')])
+    assert wait_for(lambda: pipeline.counters['risk_rejected'] == 1)
+    assert stages.reserved == [] and pipeline.counters['orders'] == 0
+
+
+def _blocked(make_pipeline, stages):
+    """A pipeline whose order stage is stuck on a slow broker, with every queue full behind it"""
+    stages.gate.clear()
+    pipeline = make_pipeline(queue_size=1)
+    pipeline.start()
+    pipeline.on_ticks([_tick(s) for s in SYMBOLS])
+    # Order stage holds one, one waits in each queue, risk and signal each hold one blocked on put
+    assert wait_for(lambda: len(stages.reserved) == 3 and pipeline.order_queue.full() and pipeline.risk_queue.full()
+                    and len(pipeline.pending) == 1)
+    return pipeline
+
+
+def test_slow_order_stage_backs_up_into_earlier_stages(make_pipeline, stages):
+    pipeline = _blocked(make_pipeline, stages)
+    time.sleep(0.3)
+    # Still blocked: nothing more reserved or evaluated while the broker is stuck
+    assert len(stages.reserved) == 3 and len(stages.evaluated) == 5
+    pipeline.on_ticks([_tick('FFF', 120)])
+    assert pipeline.counters['conflated'] == 1 and pipeline.counters['dropped'] == 0
+    stages.gate.set()
+    assert wait_for(lambda: pipeline.counters['orders'] == 6)
+    assert stages.submitted == SYMBOLS and stages.evaluated[-1] == ('FFF', 120)
+
+
+def test_stop_releases_reservations_that_never_reach_the_order_stage(app, make_pipeline, stages):
+    pipeline = _blocked(make_pipeline, stages)
+    pipeline.stop()
+    # The risk stage gives up handing its reserved event on and releases it
+    assert wait_for(lambda: app.RISK_ENGINE.released == ['CCC'])
+    stages.gate.set()
+    for thread in pipeline.threads:
+        thread.join(timeout=3)
+    assert not any(thread.is_alive() for thread in pipeline.threads)
+    # Events already in the order queue were reserved, so they drain rather than leak
+    assert stages.submitted == ['AAA', 'BBB']
+    assert sorted(stages.submitted + app.RISK_ENGINE.released) == sorted(stages.reserved)
+    assert not pipeline.pending
+    # Unreserved signals left in the risk queue are discarded on restart
+    pipeline.start()
+    assert pipeline.risk_queue.empty() and not pipeline.cooldown_until
+
+
+def test_latency_percentiles_cover_every_event(make_pipeline, stages):
+    stages.submit_delay = 0.005
+    pipeline = make_pipeline()
+    pipeline.start()
+    for symbol in SYMBOLS:
+        pipeline.on_ticks([_tick(symbol)])
+    assert wait_for(lambda: pipeline.counters['orders'] == len(SYMBOLS))
+    latency = pipeline.snapshot()['latency']
+    assert latency['queue_wait']['count'] == latency['tick_to_decision']['count'] == len(SYMBOLS)
+    assert latency['tick_to_order']['count'] == len(SYMBOLS)
+    for summary in latency.values():
+        assert 0 < summary['p50_us'] <= summary['p90_us'] <= summary['p99_us'] <= summary['max_us']
+    # Orders queue behind a 5 ms broker call; decisions do not
+    assert latency['tick_to_order']['p50_us'] >= 5000
+    assert latency['tick_to_decision']['p50_us'] < latency['tick_to_order']['p50_us']
+    assert latency['queue_wait']['p50_us'] <= latency['tick_to_decision']['p50_us']
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def risk(app, db):
+    engine = app.RISK_ENGINE
+    account = engine._account('paper')
+    account.capital = account.balance = 100000.0
+    engine.risk_level = 'medium'  # 50% of capital
+    engine.max_capital_per_trade, engine.max_daily_trades = 10000.0, 3
+    return engine
+
+
+def test_reserve_books_position_and_exposure(risk):
+    assert risk.reserve('paper', 'INFY', 'BUY', 10, 100.0) == (True, None)
+    account = risk._account('paper')
+    assert account.positions['INFY'] == [10, 1000.0]
+    assert account.exposure == 1000.0 and account.trades == 1
+
+
+def test_exposure_limit(risk):
+    assert risk.reserve('paper', 'INFY', 'BUY', 400, 100.0)[0]
+    ok, reason = risk.reserve('paper', 'TCS', 'BUY', 200, 100.0)
+    assert not ok and 'risk limit' in reason
+    # Reducing a position is always allowed
+    assert risk.reserve('paper', 'INFY', 'SELL', 100, 100.0)[0]
+
+
+def test_ai_limits(risk):
+    ok, reason = risk.reserve('paper', 'INFY', 'BUY', 200, 100.0, 'AI_AUTO')
+    assert not ok and 'max capital per trade' in reason
+    for _ in range(3):
+        assert risk.reserve('paper', 'INFY', 'BUY', 1, 100.0, 'AI_AUTO')[0]
+    ok, reason = risk.reserve('paper', 'INFY', 'BUY', 1, 100.0, 'AI_AUTO')
+    assert not ok and 'Daily trade limit' in reason
+
+
+def test_release_undoes_reserve(risk):
+    risk.reserve('paper', 'INFY', 'BUY', 10, 100.0, 'AI_AUTO', True)
+    risk.release('paper', 'INFY', 'BUY', 10, 100.0, 'AI_AUTO', True)
+    account = risk._account('paper')
+    assert account.positions == {} and account.exposure == 0
+    assert account.trades == account.ai_trades == 0 and account.balance == 100000.0
+
+
+def test_settle_books_pnl_without_counting_a_trade(risk):
+    risk.reserve('paper', 'INFY', 'BUY', 10, 100.0, 'AI_AUTO', True)
+    risk.settle('paper', 'INFY', 'BUY', 10, 100.0, 110.0, 100.0, credit=True)
+    account = risk._account('paper')
+    assert account.trades == 1 and account.ai_trades == 1
+    assert account.positions == {} and account.realized_pnl == 100.0
+    assert account.balance == 100100.0
+
+
+def test_daily_loss_limit(risk):
+    account = risk._account('paper')
+    account.daily_limit = 50.0
+    risk.reserve('paper', 'INFY', 'BUY', 10, 100.0)
+    risk.settle('paper', 'INFY', 'BUY', 10, 100.0, 90.0, -100.0)
+    ok, reason = risk.reserve('paper', 'INFY', 'BUY', 1, 100.0)
+    assert not ok and 'Daily loss limit' in reason
+
+
+def test_concurrent_reserves_never_overshoot(risk):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(risk.reserve('paper', 'INFY', 'BUY', 10, 100.0)[0]))
+               for _ in range(100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 50% of 100000 capital fits exactly 50 lots of 1000
+    assert results.count(True) == 50
+    assert risk._account('paper').exposure == 50000.0
+
+
+def test_load_rebuilds_open_positions(app, risk):
+    client = app.app.test_client()
+    assert client.post('/api/place-order', json={'symbol': 'INFY', 'side': 'BUY', 'quantity': 5,
+                                                 'price': 100}).status_code == 200
+    engine = app.RiskEngine()
+    engine.load()
+    account = engine._account('paper')
+    assert account.positions['INFY'] == [5, 500.0] and account.trades == 1
@@ -0,0 +1,100 @@
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+
+def _job(legs, paths=2000, days=1, steps_per_day=50, vols=(0.3, 0.3), seed=1):
+    return {'paths': paths, 'days': days, 'steps_per_day': steps_per_day, 'seed': seed,
+            'prices': [100.0, 200.0], 'vols': list(vols), 'cholesky': np.eye(2).tolist(), 'legs': legs}
+
+
+@pytest.fixture
+def stress(app, db, monkeypatch):
+    # Threads instead of the process pool: same chunk code, no forkserver per test
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(app, 'STRESS_POOL', pool)
+
+    def bars(symbol, interval, start, end=None):
+        # 120 days of deterministic closes, so the run does not reach out to Yahoo
+        closes = 100 * np.exp(np.cumsum(np.random.default_rng(len(symbol)).normal(0, 0.01, 120)))
+        return {'ts': np.arange(120) * 86400 + int(time.time()) - 120 * 86400, 'close': closes}
+
+    monkeypatch.setattr(app.HISTORY_STORE, 'get_bars', bars)
+    yield app
+    pool.shutdown()
+
+
+def test_chunk_is_deterministic_for_a_seed(app):
+    legs = [{'symbol': 0, 'direction': 1, 'quantity': 10, 'entry_step': 0}]
+    first, second = app._stress_chunk(_job(legs)), app._stress_chunk(_job(legs))
+    assert np.array_equal(first[0], second[0]) and np.array_equal(first[1], second[1])
+    assert not np.array_equal(first[0], app._stress_chunk(_job(legs, seed=2))[0])
+
+
+def test_opposite_legs_cancel_and_zero_vol_is_flat(app):
+    hedged = [{'symbol': 1, 'direction': 1, 'quantity': 5, 'entry_step': 10},
+              {'symbol': 1, 'direction': -1, 'quantity': 5, 'entry_step': 10}]
+    final, worst = app._stress_chunk(_job(hedged))
+    assert np.allclose(final, 0) and np.allclose(worst, 0)
+    final, _ = app._stress_chunk(_job([{'symbol': 0, 'direction': 1, 'quantity': 5, 'entry_step': 0}],
+                                      vols=(0.0, 0.0)))
+    assert np.allclose(final, 0)
+
+
+def test_worst_intraday_pnl_bounds_the_close(app):
+    legs = [{'symbol': 0, 'capital': 10000, 'entry_step': 5, 'exit_step': 50, 'stop_pct': 0.01, 'take_pct': 0.02}]
+    final, worst = app._stress_chunk(_job(legs))
+    assert (worst <= 0).all() and (worst <= final + 1e-9).all()
+
+
+def test_legs_exit_at_stop_or_target(app):
+    legs = [{'symbol': 0, 'direction': 1, 'capital': 10000, 'entry_step': 5, 'stop_pct': 0.01, 'take_pct': 0.02}]
+    # At 100% vol almost every path reaches a bracket, overshooting it by about one step's move
+    final, _ = app._stress_chunk(_job(legs, steps_per_day=375, vols=(1.0, 1.0)))
+    stopped, taken = final < -70, final > 150
+    assert (stopped | taken).mean() > 0.95
+    assert abs(np.median(final[stopped]) + 100) < 20 and abs(np.median(final[taken]) - 200) < 20
+
+
+def test_stress_endpoint_is_reproducible(stress, client):
+    payload = {'paths': 3000, 'seed': 7, 'steps_per_day': 30}
+    first = client.post('/api/paper-account/stress-test', json=payload).get_json()
+    second = client.post('/api/paper-account/stress-test', json=payload).get_json()
+    assert first['pnl'] == second['pnl'] and first['var'] == second['var']
+    assert first['inputs']['market_params'] == 'history'
+    assert first['var']['99'] >= first['var']['95']
+    assert first['cvar']['95'] >= first['var']['95']
+    assert sum(first['histogram']['counts']) == 3000
+
+
+def test_open_positions_are_simulated(stress, client, db):
+    conn = sqlite3.connect(db)
+    conn.execute("""INSERT INTO trades (trade_id, symbol, side, quantity, entry_price, stop_loss, take_profit,
+                                        account_type)
+                    VALUES ('STRESS1', 'TCS', 'BUY', 10, 3800, 3700, 3900, 'paper')""")
+    conn.commit()
+    conn.close()
+    body = client.get('/api/paper-account/stress-test?paths=500&seed=1&max_daily_trades=0').get_json()
+    assert body['inputs']['open_positions'] == 1 and body['inputs']['ai_trades_per_day'] == 0
+    # One long position bracketed by its stop and target
+    assert -1000 * 1.2 < body['pnl']['min'] and body['pnl']['max'] < 1000 * 1.2
+
+
+def test_chunks_are_sized_by_memory(stress, monkeypatch):
+    monkeypatch.setattr(stress, 'STRESS_CHUNK_ELEMENTS', 100000)
+    result = stress.run_stress_test(paths=5000, days=2, steps_per_day=50, seed=3)
+    per_path = (2 * 50 + 1) * (len(result['inputs']['symbols']) + 3)
+    assert result['chunk_paths'] == 100000 // per_path
+    assert result['chunks'] == -(-5000 // result['chunk_paths'])
+
+
+def test_stress_endpoint_rejects_bad_input(stress, client, monkeypatch):
+    assert client.get('/api/paper-account/stress-test?paths=0').status_code == 400
+    assert client.get('/api/paper-account/stress-test?paths=x').status_code == 400
+    assert client.get('/api/paper-account/stress-test?horizon_days=21').status_code == 400
+    monkeypatch.setattr(stress, 'STRESS_MAX_ELEMENTS', 10000)
+    response = client.get('/api/paper-account/stress-test?paths=1000')
+    assert response.status_code == 400 and 'too large' in response.get_json()['error']
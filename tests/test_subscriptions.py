@@ -0,0 +1,102 @@
+import pytest
+
+
+class FakeTicker:
+    """Stands in for KiteTicker: records what the manager asks the server for"""
+
+    def __init__(self):
+        self.calls = []
+        self.subscribed = set()
+        self.modes = {}
+
+    def connect(self, threaded=False):
+        self.calls.append(('connect',))
+
+    def subscribe(self, tokens):
+        self.calls.append(('subscribe', sorted(tokens)))
+        self.subscribed.update(tokens)
+
+    def unsubscribe(self, tokens):
+        self.calls.append(('unsubscribe', sorted(tokens)))
+        self.subscribed.difference_update(tokens)
+        for token in tokens:
+            self.modes.pop(token, None)
+
+    def set_mode(self, mode, tokens):
+        self.calls.append(('set_mode', mode, sorted(tokens)))
+        self.modes.update(dict.fromkeys(tokens, mode))
+
+
+@pytest.fixture
+def manager(app):
+    tickers = []
+
+    def factory():
+        tickers.append(FakeTicker())
+        return tickers[-1]
+
+    manager = app.SubscriptionManager(factory, max_tokens=3, max_connections=2)
+    manager.tickers = tickers
+    manager.start()
+    manager.on_connect(tickers[0])
+    return manager
+
+
+def test_tokens_are_reference_counted_across_owners(manager):
+    ws = manager.tickers[0]
+    manager.acquire('watchlist', [1, 2], 'quote')
+    manager.acquire('ai', [2], 'quote')
+    assert ws.subscribed == {1, 2}
+    assert ws.calls.count(('subscribe', [2])) == 0  # Second owner of 2 changes nothing
+    manager.release('watchlist')
+    assert ws.subscribed == {2}
+    assert ws.calls[-1] == ('unsubscribe', [1])
+    manager.release('ai', [2])
+    assert ws.subscribed == set() and manager.snapshot()['owners'] == {}
+
+
+def test_mode_is_the_cheapest_that_satisfies_every_owner(manager):
+    ws = manager.tickers[0]
+    manager.acquire('exit_triggers', [7], 'ltp')
+    assert ws.modes == {7: 'ltp'}
+    manager.acquire('depth', [7], 'full')
+    assert ws.modes == {7: 'full'}
+    sent = len(ws.calls)
+    manager.acquire('watchlist', [7], 'quote')
+    assert ws.modes == {7: 'full'} and len(ws.calls) == sent
+    manager.release('depth')
+    assert ws.modes == {7: 'quote'}
+    with pytest.raises(ValueError):
+        manager.acquire('x', [8], 'depth')
+
+
+def test_spills_to_a_second_shard_then_runs_out(manager):
+    manager.acquire('watchlist', [1, 2, 3, 4], 'quote')
+    assert len(manager.tickers) == 2
+    first, second = manager.tickers
+    # The new connection has not connected yet, so nothing is sent on it
+    assert len(first.subscribed) == 3 and second.calls == [('connect',)]
+    manager.on_connect(second)
+    assert first.subscribed | second.subscribed == {1, 2, 3, 4}
+    manager.acquire('watchlist', [5, 6, 7], 'quote')
+    snapshot = manager.snapshot()
+    assert snapshot['unassigned'] == 1 and len(manager.tickers) == 2
+    assert [shard['assigned'] for shard in snapshot['shards']] == [3, 3]
+    # Freed capacity picks the leftover token up on the next reconcile
+    manager.release('watchlist', [1])
+    assert manager.snapshot()['unassigned'] == 0
+    assert len(first.subscribed | second.subscribed) == 6
+
+
+def test_reconnect_resubscribes_everything(manager):
+    ws = manager.tickers[0]
+    manager.acquire('watchlist', [1, 2], 'quote')
+    manager.acquire('depth', [2], 'full')
+    manager.on_close(ws)
+    ws.calls.clear()
+    manager.acquire('ai', [3], 'ltp')
+    assert ws.calls == []  # Nothing is sent while disconnected
+    manager.on_connect(ws)
+    assert ws.calls[0] == ('subscribe', [1, 2, 3])
+    assert ws.modes == {1: 'quote', 2: 'full', 3: 'ltp'}
+    assert manager.snapshot()['shards'][0]['subscribed'] == 3
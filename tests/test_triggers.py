@@ -0,0 +1,184 @@
+import sqlite3
+
+import pytest
+
+from conftest import wait_for
+
+
+@pytest.fixture
+def engine(app):
+    fired, books = [], []
+    engine = app.TriggerEngine(lambda trigger, kind, price: fired.append((trigger.trade_id, kind, price)),
+                               lambda symbol, active: books.append((symbol, active)))
+    engine.fired_exits, engine.book_events = fired, books
+    return engine
+
+
+def test_stop_loss_and_take_profit(engine):
+    engine.register('LONG', 'INFY', 'BUY', 100.0, stop_loss=95.0, take_profit=110.0)
+    engine.register('SHORT', 'INFY', 'SELL', 100.0, stop_loss=105.0, take_profit=90.0)
+    assert engine.on_price('INFY', 100.0) == 0
+    assert engine.on_price('INFY', 106.0) == 1
+    assert engine.fired_exits == [('SHORT', 'STOP_LOSS', 106.0)]
+    assert engine.on_price('INFY', 111.0) == 1
+    assert engine.fired_exits[-1] == ('LONG', 'TAKE_PROFIT', 111.0)
+    # Fired triggers are gone
+    assert engine.on_price('INFY', 80.0) == 0
+
+
+def test_trailing_stop_follows_the_best_price(engine):
+    engine.register('T', 'INFY', 'BUY', 100.0, trailing_pct=5)
+    engine.on_price('INFY', 120.0)
+    assert engine.on_price('INFY', 115.0) == 0  # Stop moved up to 114
+    assert engine.on_price('INFY', 113.9) == 1
+    assert engine.fired_exits == [('T', 'STOP_LOSS', 113.9)]
+
+
+def test_cancel(engine):
+    engine.register('T', 'INFY', 'BUY', 100.0, stop_loss=95.0)
+    assert engine.cancel('T') and not engine.cancel('T')
+    assert engine.on_price('INFY', 90.0) == 0
+
+
+def test_book_events_track_first_and_last_trigger(engine):
+    engine.register('A', 'INFY', 'BUY', 100.0, stop_loss=95.0)
+    engine.register('B', 'INFY', 'BUY', 100.0, stop_loss=90.0)
+    assert engine.book_events == [('INFY', True)]
+    engine.cancel('A')
+    assert engine.book_events == [('INFY', True)]
+    engine.on_price('INFY', 89.0)
+    assert engine.book_events == [('INFY', True), ('INFY', False)]
+
+
+def test_register_without_levels_is_a_no_op(engine):
+    assert not engine.register('T', 'INFY', 'BUY', 100.0)
+    assert engine.book_events == []
+
+
+def _balance(db):
+    return sqlite3.connect(db).execute("SELECT balance FROM paper_accounts").fetchone()[0]
+
+
+def _ai_settings(account_type):
+    # Row layout of ai_trading_settings: account type at 3, SL/TP percentages at 7 and 8
+    return [0, 'default', 1, account_type, 0, 10, 0, 2.0, 4.0, 30, 0, 0, 0, 0]
+
+
+def _signal(symbol='TCS', price=100.0):
+    return {'symbol': symbol, 'signal': 'BUY', 'current_price': price, 'confidence': 90, 'reasons': ['test']}
+
+
+def test_ai_trade_credits_its_debit_back(app, db):
+    trade_id = app._record_ai_trade(_signal(), _ai_settings('paper'), 10)
+    assert _balance(db) == 1000000.0 - 1000.0
+    ok, _ = app.close_trade(trade_id, 110.0, 'TEST')
+    assert ok and _balance(db) == 1000000.0 + 100.0
+
+
+def test_client_strategy_does_not_credit_the_balance(client, db):
+    trade_id = client.post('/api/place-order', json={'symbol': 'INFY', 'side': 'BUY', 'quantity': 1, 'price': 100,
+                                                     'strategy': 'AI_AUTO'}).get_json()['trade_id']
+    response = client.post(f'/api/trades/{trade_id}/close', json={'price': 50000})
+    assert response.status_code == 200
+    assert _balance(db) == 1000000.0
+
+
+def test_close_endpoint_status_codes(app, client, monkeypatch):
+    assert client.post('/api/trades/NOPE/close', json={'price': 10}).status_code == 404
+    trade_id = client.post('/api/place-order', json={'symbol': 'INFY', 'side': 'BUY', 'quantity': 1,
+                                                     'price': 100}).get_json()['trade_id']
+    monkeypatch.setattr(app.RISK_ENGINE, 'settle', lambda *args: 1 / 0)
+    assert client.post(f'/api/trades/{trade_id}/close', json={'price': 10}).status_code == 500
+
+
+class _Gateway:
+    def submit(self, kind, params, on_ack=None):
+        self.on_ack = on_ack
+        return 'G1'
+
+
+def test_failed_live_entry_is_rolled_back(app, db, monkeypatch):
+    gateway = _Gateway()
+    monkeypatch.setattr(app, 'get_order_gateway', lambda: gateway)
+    monkeypatch.setattr(app, 'TRIGGERS', app.TriggerEngine(lambda *args: None))
+    account = app.RISK_ENGINE._account('real')
+    account.capital = account.balance = 1000000.0
+    assert app.RISK_ENGINE.reserve('real', 'TCS', 'BUY', 10, 100.0, 'AI_AUTO')[0]
+    trade_id = app._record_ai_trade(_signal(), _ai_settings('real'), 10)
+    # Exits are armed only once the entry is acked
+    assert app.TRIGGERS.snapshot()['live_triggers'] == 0
+    gateway.on_ack({'request_id': 'G1', 'order_id': None, 'status': 'FAILED', 'error': 'rejected'})
+    row = sqlite3.connect(db).execute("SELECT status, exit_price, pnl FROM trades WHERE trade_id = ?",
+                                      (trade_id,)).fetchone()
+    assert row == ('FAILED', 100.0, 0.0)
+    assert account.exposure == 0 and account.ai_trades == 0
+    assert app.TRIGGERS.snapshot()['live_triggers'] == 0
+
+
+def test_acked_live_entry_arms_its_exits(app, db, monkeypatch):
+    gateway = _Gateway()
+    monkeypatch.setattr(app, 'get_order_gateway', lambda: gateway)
+    monkeypatch.setattr(app, 'TRIGGERS', app.TriggerEngine(lambda *args: None))
+    app._record_ai_trade(_signal(), _ai_settings('real'), 10)
+    gateway.on_ack({'request_id': 'G1', 'order_id': 'O1', 'status': 'ACKED', 'error': None})
+    assert app.TRIGGERS.snapshot()['live_triggers'] == 1
+
+
+def test_fired_trigger_closes_the_trade(app, client, db):
+    trade_id = client.post('/api/place-order', json={'symbol': 'INFY', 'side': 'BUY', 'quantity': 1, 'price': 100,
+                                                     'stop_loss': 95}).get_json()['trade_id']
+    app.TRIGGERS.on_price('INFY', 94.0)
+    closed = lambda: sqlite3.connect(db).execute("SELECT exit_price FROM trades WHERE trade_id = ?",
+                                                 (trade_id,)).fetchone()[0]
+    assert wait_for(lambda: closed() == 94.0)
+
+
+def test_pending_live_entry_cannot_be_closed(app, client, db, monkeypatch):
+    gateway = _Gateway()
+    monkeypatch.setattr(app, 'get_order_gateway', lambda: gateway)
+    monkeypatch.setattr(app, 'TRIGGERS', app.TriggerEngine(lambda *args: None))
+    trade_id = app._record_ai_trade(_signal(), _ai_settings('real'), 10)
+    entry_ack = gateway.on_ack
+    assert client.post(f'/api/trades/{trade_id}/close', json={'price': 105}).status_code == 409
+    # The refused close left the trade alone, so a failed entry still rolls it back
+    entry_ack({'request_id': 'G1', 'order_id': None, 'status': 'FAILED', 'error': 'rejected'})
+    row = sqlite3.connect(db).execute("SELECT status, exit_price FROM trades WHERE trade_id = ?",
+                                      (trade_id,)).fetchone()
+    assert row == ('FAILED', 100.0)
+
+
+def test_failed_live_exit_reopens_the_trade(app, db, monkeypatch):
+    gateway = _Gateway()
+    monkeypatch.setattr(app, 'get_order_gateway', lambda: gateway)
+    monkeypatch.setattr(app, 'TRIGGERS', app.TriggerEngine(lambda *args: None))
+    account = app.RISK_ENGINE._account('real')
+    account.capital = account.balance = 1000000.0
+    assert app.RISK_ENGINE.reserve('real', 'TCS', 'BUY', 10, 100.0, 'AI_AUTO')[0]
+    trade_id = app._record_ai_trade(_signal(), _ai_settings('real'), 10)
+    gateway.on_ack({'request_id': 'G1', 'order_id': 'O1', 'status': 'ACKED', 'error': None})
+    before = (account.exposure, account.turnover, account.realized_pnl, {s: list(p) for s, p in account.positions.items()})
+
+    ok, _ = app.close_trade(trade_id, 104.0, 'TEST')
+    assert ok and account.realized_pnl == 40.0 and 'TCS' not in account.positions
+    assert app.TRIGGERS.snapshot()['live_triggers'] == 0
+    gateway.on_ack({'request_id': 'G2', 'order_id': None, 'status': 'FAILED', 'error': 'rejected'})
+
+    row = sqlite3.connect(db).execute("SELECT status, exit_price, pnl, exit_timestamp FROM trades "
+                                      "WHERE trade_id = ?", (trade_id,)).fetchone()
+    assert row == ('OPEN', None, None, None)
+    assert (account.exposure, account.turnover, account.realized_pnl, account.positions) == before
+    assert app.TRIGGERS.snapshot()['live_triggers'] == 1
+    # Still closable once the position is back
+    assert app.close_trade(trade_id, 98.0, 'TEST')[0]
+
+
+def test_acked_live_exit_keeps_the_trade_closed(app, db, monkeypatch):
+    gateway = _Gateway()
+    monkeypatch.setattr(app, 'get_order_gateway', lambda: gateway)
+    monkeypatch.setattr(app, 'TRIGGERS', app.TriggerEngine(lambda *args: None))
+    trade_id = app._record_ai_trade(_signal(), _ai_settings('real'), 10)
+    gateway.on_ack({'request_id': 'G1', 'order_id': 'O1', 'status': 'ACKED', 'error': None})
+    app.close_trade(trade_id, 104.0, 'TEST')
+    gateway.on_ack({'request_id': 'G2', 'order_id': 'O2', 'status': 'ACKED', 'error': None})
+    assert sqlite3.connect(db).execute("SELECT exit_price FROM trades WHERE trade_id = ?",
+                                       (trade_id,)).fetchone() == (104.0,)
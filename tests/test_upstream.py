@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def upstream(app):
+    return app.Upstream('test', timeout=0.2, max_concurrent=2, failure_threshold=2, reset_timeout=0.3)
+
+
+def test_success_returns_fresh_value(upstream):
+    assert upstream.call(lambda x: x * 2, 21, cache_key='k') == (42, None)
+
+
+def test_timeout_serves_last_good_value(app, upstream):
+    upstream.call(lambda: 'fresh', cache_key='k')
+    value, stale_age = upstream.call(lambda: time.sleep(1) or 'late', cache_key='k')
+    assert value == 'fresh' and stale_age is not None
+    with pytest.raises(app.UpstreamUnavailable):
+        upstream.call(lambda: time.sleep(1), cache_key='never-cached')
+
+
+def test_breaker_opens_and_recovers(app, upstream):
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    for _ in range(2):
+        with pytest.raises(app.UpstreamUnavailable):
+            upstream.call(failing)
+    with pytest.raises(app.UpstreamUnavailable, match='circuit open'):
+        upstream.call(failing)
+    assert len(calls) == 2  # The open circuit short-circuits without calling
+    time.sleep(0.35)
+    assert upstream.call(lambda: 'ok') == ('ok', None)
+    assert upstream.breaker.state == upstream.breaker.CLOSED
+
+
+def test_bad_requests_do_not_trip_the_breaker(app):
+    upstream = app.Upstream('test', timeout=1, failure_threshold=1, is_outage=lambda e: not isinstance(e, ValueError))
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            upstream.call(lambda: int('x'))
+    assert upstream.breaker.state == upstream.breaker.CLOSED
+
+
+def test_bulkhead_caps_concurrent_calls(app, upstream):
+    release = threading.Event()
+
+    def hold():
+        try:
+            upstream.call(release.wait)
+        except app.UpstreamUnavailable:
+            pass  # Gives up waiting after the timeout but keeps its slot until release
+
+    for _ in range(2):
+        threading.Thread(target=hold, daemon=True).start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    with pytest.raises(app.UpstreamUnavailable):
+        upstream.call(lambda: 'queued')
+    # Waiting for a slot comes out of the same timeout
+    assert time.monotonic() - started < 0.5
+    release.set()
+
+
+def test_instrument_dumps_use_the_bulk_upstream(app, db, monkeypatch):
+    class SlowKite:
+        def instruments(self, exchange):
+            time.sleep(0.3)
+            return [{'instrument_token': 1, 'tradingsymbol': 'INFY', 'exchange': exchange, 'name': 'INFOSYS',
+                     'segment': exchange, 'instrument_type': 'EQ'}]
+
+    monkeypatch.setattr(app, 'kite', SlowKite())
+    monkeypatch.setitem(app.UPSTREAMS, 'kite', app.Upstream('kite', timeout=0.1))
+    monkeypatch.setitem(app.UPSTREAMS, 'kite_bulk', app.Upstream('kite_bulk', timeout=5, ignore_deadline=True))
+    assert app.build_instruments_map()
+    assert app.token_by_symbol['INFY'] == 1
+    assert app.UPSTREAMS['kite'].snapshot()['calls'] == 0
+
+
+def test_bulk_upstream_outlives_the_request_budget(app, db, monkeypatch):
+    class SlowKite:
+        def instruments(self, exchange):
+            time.sleep(0.3)
+            return [{'instrument_token': 2, 'tradingsymbol': 'TCS', 'exchange': exchange, 'name': 'TCS',
+                     'segment': exchange, 'instrument_type': 'EQ'}]
+
+    monkeypatch.setattr(app, 'kite', SlowKite())
+    assert app.UPSTREAMS['kite_bulk'].ignore_deadline
+    monkeypatch.setitem(app.UPSTREAMS, 'kite_bulk', app.Upstream('kite_bulk', timeout=5, ignore_deadline=True))
+    with app.app.test_request_context('/api/instruments/search', headers={'X-Request-Budget-Ms': '100'}):
+        app.set_request_deadline()
+        guarded = app.Upstream('guarded', timeout=5)
+        with pytest.raises(app.UpstreamUnavailable):
+            guarded.call(time.sleep, 0.3)
+        assert app.build_instruments_map()
+    assert app.token_by_symbol['TCS'] == 2
+    assert app.UPSTREAMS['kite_bulk'].snapshot()['timeouts'] == 0
+
+
+def test_request_budget_header(app, client, monkeypatch):
+    class SlowKite:
+        def quote(self, scrips):
+            time.sleep(2)
+
+    monkeypatch.setattr(app, 'kite', SlowKite())
+    monkeypatch.setattr(app, 'ZERODHA_CONNECTED', True)
+    monkeypatch.setitem(app.UPSTREAMS, 'kite', app.Upstream('kite', timeout=5))
+    started = time.monotonic()
+    response = client.get('/api/zerodha/quote/TCS', headers={'X-Request-Budget-Ms': '200'})
+    assert time.monotonic() - started < 1.5
+    assert response.status_code >= 500